@@ -0,0 +1,122 @@
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import request, session
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+import metrics
+from cache import LRUCache
+
+RATE_LIMIT_CLIENTS = int(os.environ.get('RATE_LIMIT_CLIENTS', 100000))
+
+REJECTIONS = metrics.register(metrics.Counter(
+    'admission_rejections_total', 'Requests turned away by admission control.', ('limit', 'reason')))
+QUEUE_DEPTH = metrics.register(metrics.Gauge(
+    'admission_queue_depth', 'Requests waiting for a concurrency gate.', ('gate',)))
+IN_FLIGHT = metrics.register(metrics.Gauge(
+    'admission_in_flight', 'Requests holding a concurrency gate slot.', ('gate',)))
+QUEUE_WAIT = metrics.register(metrics.Histogram(
+    'admission_queue_wait_seconds', 'Time spent waiting for a concurrency gate slot.', ('gate',)))
+
+
+def client_key():
+    # Logged-in users are limited per account, everyone else per address.
+    # Behind a proxy remote_addr is the proxy's unless TRUSTED_PROXIES is set
+    # (see app.py), and every anonymous client would share one bucket.
+    user_id = session.get('user_id')
+    return f'user:{user_id}' if user_id else f'ip:{request.remote_addr}'
+
+
+class RateLimiter:
+    # Token bucket per client: `burst` requests at once, refilled at `rate`
+    # per second. A bucket left alone for burst/rate seconds is full again,
+    # so that is also how long it needs to be remembered.
+    def __init__(self, name, rate, burst, maxsize=RATE_LIMIT_CLIENTS):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._buckets = LRUCache(maxsize=maxsize, ttl=burst / rate)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        # Seconds until a token is available; 0 means one was taken.
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens >= 1:
+                self._buckets.set(key, (tokens - 1, now))
+                return 0
+            self._buckets.set(key, (tokens, now))
+        return (1 - tokens) / self.rate
+
+    def check(self):
+        wait = self.take(client_key())
+        if wait:
+            REJECTIONS.inc(self.name, 'rate')
+            raise TooManyRequests(f"Too many requests. Try again in {math.ceil(wait)} seconds.",
+                                  retry_after=math.ceil(wait))
+
+
+def rate_limited(limiter, methods=('POST',)):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method in methods:
+                limiter.check()
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ConcurrencyGate:
+    # At most `limit` requests inside at once. Up to `queue_size` more wait
+    # their turn for at most `timeout` seconds; anyone beyond that is turned
+    # away at once rather than piling up behind a scarce resource.
+    def __init__(self, name, limit, queue_size, timeout, retry_after=1,
+                 message="The server is busy right now. Please try again shortly."):
+        self.name = name
+        self.message = message
+        self.timeout = timeout
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+
+    def _reject(self, reason):
+        REJECTIONS.inc(self.name, reason)
+        raise ServiceUnavailable(self.message, retry_after=self.retry_after)
+
+    def _update(self, waiting=0, in_flight=0):
+        with self._lock:
+            self._waiting += waiting
+            self._in_flight += in_flight
+            QUEUE_DEPTH.set(self.name, value=self._waiting)
+            IN_FLIGHT.set(self.name, value=self._in_flight)
+
+    def __enter__(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                full = self._waiting >= self.queue_size
+                if not full:
+                    self._waiting += 1
+                    QUEUE_DEPTH.set(self.name, value=self._waiting)
+            if full:
+                self._reject('queue_full')
+            started = time.perf_counter()
+            acquired = self._slots.acquire(timeout=self.timeout)
+            QUEUE_WAIT.observe(self.name, value=time.perf_counter() - started)
+            self._update(waiting=-1)
+            if not acquired:
+                self._reject('queue_timeout')
+        self._update(in_flight=1)
+        return self
+
+    def __exit__(self, *exc):
+        self._update(in_flight=-1)
+        self._slots.release()
@@ -1,41 +1,118 @@
+import base64
+import binascii
+import heapq
 import os
-import random
-import sqlite3
+import secrets
+import time
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, flash, send_from_directory, jsonify, make_response
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+from itsdangerous import BadSignature, URLSafeSerializer
+from markupsafe import Markup
+from werkzeug.exceptions import HTTPException
+from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import admission
+import assets
+import db
+import export
+import http_cache
+import itineraries
+import metrics
+import migrations
+import passwords
+import seats
+import stats
+import tickets
+from cache import LRUCache
+from catalog import get_catalog
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 app.secret_key = os.getenv("SECRET_KEY", os.urandom(24))
 app.config['DATABASE'] = 'flights.db'
 app.config['ADMIN_DB'] = 'admin.db'
 app.config['USERS_DB'] = 'users.db'
+app.config['ADMIN_CREDENTIALS'] = os.getenv(
+    'ADMIN_CREDENTIALS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'admin_credentials.json'))
 CORS(app)
+# Reverse proxies (load balancer, router) in front of the app. Each appends
+# the address it saw to X-Forwarded-For; trusting exactly that many hops
+# gives rate limiting the real client address without letting a client
+# forge its own. 0 means clients connect directly.
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 
 MAX_BOOKING_DAYS = 365
 FRONTEND_DATE_FORMAT = '%d-%m-%Y'
-ADMINS = {
-    "Harishwar S": generate_password_hash("Harishwar@"),
-    "Suhas J": generate_password_hash("Suhas@123")
-}
+FLIGHTS_PAGE_SIZE = 24
+MAX_FLIGHTS_PAGE_SIZE = 200
+FARE_CALENDAR_WINDOW = 3
+MAX_FARE_CALENDAR_WINDOW = 15
+TICKET_WAIT_SECONDS = 2
+MAX_GROUP_SIZE = 9
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL = 60
+FRAGMENT_CACHE_SIZE = 4096
+# Token buckets per user or client address: requests per second, burst.
+SEARCH_RATE = float(os.getenv('SEARCH_RATE', 2))
+SEARCH_BURST = int(os.getenv('SEARCH_BURST', 10))
+BOOKING_RATE = float(os.getenv('BOOKING_RATE', 0.5))
+BOOKING_BURST = int(os.getenv('BOOKING_BURST', 5))
+# Claiming an account takes an email and a booking reference: a handful of
+# tries, then one a minute.
+CLAIM_RATE = float(os.getenv('CLAIM_RATE', 1 / 60))
+CLAIM_BURST = int(os.getenv('CLAIM_BURST', 5))
+# SQLite has one writer at a time; a couple of slots keep it busy while the
+# next request gets ready, and the rest wait here instead of in busy_timeout.
+BOOKING_CONCURRENCY = int(os.getenv('BOOKING_CONCURRENCY', 2))
+BOOKING_QUEUE = int(os.getenv('BOOKING_QUEUE', 32))
+BOOKING_QUEUE_TIMEOUT = float(os.getenv('BOOKING_QUEUE_TIMEOUT', 3))
+ADMINS = passwords.load_admins(app.config['ADMIN_CREDENTIALS'])
+# Built by `python assets.py`; read once here.
+ASSETS = assets.load_manifest(app.static_folder)
+
+db.init_app(app)
+metrics.init_app(app)
+ticket_queue = tickets.TicketQueue(on_rendered=lambda seconds: metrics.observe_ticket('background', seconds))
+user_profiles = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+user_bookings = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# Rendered, user-independent page fragments keyed on the catalog/flight
+# versions they were rendered from, so a stale entry is simply never asked
+# for again and ages out of the LRU.
+fragments = LRUCache(maxsize=FRAGMENT_CACHE_SIZE)
+search_limiter = admission.RateLimiter('search', SEARCH_RATE, SEARCH_BURST)
+booking_limiter = admission.RateLimiter('booking', BOOKING_RATE, BOOKING_BURST)
+claim_limiter = admission.RateLimiter('claim', CLAIM_RATE, CLAIM_BURST)
+booking_gate = admission.ConcurrencyGate(
+    'booking', BOOKING_CONCURRENCY, BOOKING_QUEUE, BOOKING_QUEUE_TIMEOUT,
+    message="We are handling a lot of bookings right now. Please try again shortly.")
+FRAGMENT_LOOKUPS = metrics.register(metrics.Counter(
+    'fragment_cache_lookups_total', 'Rendered fragment cache lookups.', ('fragment', 'result')))
+TEMPLATES_VERSION = http_cache.templates_digest(os.path.join(app.root_path, 'templates'))
 
+# admin.db and users.db are ATTACHed to the flights.db connection, so all
+# three factories hand back the same connection and a request can commit
+# across the files at once. Table names are unique across the three, so
+# queries don't need the schema prefix, except for stats: every file has
+# its own, so app queries must always say main.stats, admin.stats or
+# users.stats (the triggers that keep them are fine unqualified; a trigger
+# only sees tables in its own file).
 def get_db_connection():
-    conn = sqlite3.connect(app.config['DATABASE'])
-    conn.row_factory = sqlite3.Row
-    return conn
+    return metrics.instrument(db.get_connection(
+        app.config['DATABASE'],
+        attach={'admin': app.config['ADMIN_DB'], 'users': app.config['USERS_DB']},
+        migrate=migrations.migrate))
 
 def get_admin_connection():
-    conn = sqlite3.connect(app.config['ADMIN_DB'])
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_db_connection()
 
 def get_user_connection():
-    conn = sqlite3.connect(app.config['USERS_DB'])
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_db_connection()
+
+def new_booking_ref():
+    return f"BK{datetime.now().strftime('%Y%m%d')}{secrets.token_hex(4).upper()}"
 
 def validate_date(date_str):
     try:
@@ -52,52 +129,236 @@ def validate_date(date_str):
     except ValueError:
         return False, "Invalid date format"
 
+def load_user_profile(user_id):
+    row = get_user_connection().execute(
+        "SELECT id, username, full_name, email, phone, passport, created_at FROM users WHERE id = ?",
+        (user_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+def load_user_bookings(user_id):
+    rows = get_db_connection().execute('''
+        SELECT b.id as booking_id, b.booking_ref, b.seat_number, b.payment_amount, b.created_at,
+               f.flight_no, f.origin, f.destination, f.departure
+        FROM bookings b
+        JOIN flights f ON f.id = b.flight_id
+        WHERE b.user_id = ?
+        ORDER BY b.created_at DESC
+        LIMIT 10
+    ''', (user_id,)).fetchall()
+    return [dict(r) for r in rows]
+
+def invalidate_user_cache(user_id):
+    user_profiles.pop(user_id)
+    user_bookings.pop(user_id)
+
+def cached_user_value(cache, loader, default):
+    user_id = session.get('user_id')
+    if not user_id:
+        return default
+    try:
+        return cache.get_or_load(user_id, lambda: loader(user_id))
+    except Exception as e:
+        app.logger.exception("Error injecting user: %s", e)
+        return default
+
 @app.context_processor
 def inject_user():
-    user = None
-    bookings = []
-    if session.get('user_id'):
-        try:
-            with get_user_connection() as uconn:
-                user_row = uconn.execute(
-                    "SELECT id, username, full_name, email, phone, passport, created_at FROM users WHERE id = ?",
-                    (session['user_id'],)
-                ).fetchone()
-                if user_row:
-                    user = dict(user_row)
-            with get_db_connection() as conn:
-                user_bookings = conn.execute('''
-                    SELECT b.id as booking_id, b.booking_ref, b.seat_number, b.payment_amount, b.created_at,
-                           f.flight_no, f.origin, f.destination, f.departure
-                    FROM bookings b
-                    JOIN flights f ON f.id = b.flight_id
-                    WHERE b.user_id = ?
-                    ORDER BY b.created_at DESC
-                    LIMIT 10
-                ''', (session['user_id'],)).fetchall()
-                bookings = [dict(r) for r in user_bookings]
-        except Exception as e:
-            print("Error injecting user:", e)
-    return dict(current_user=user, current_user_bookings=bookings)
+    # Proxies resolve on first use in the template, so pages that never
+    # show the user menu never touch the cache or the database.
+    return dict(
+        current_user=LocalProxy(lambda: cached_user_value(user_profiles, load_user_profile, None)),
+        current_user_bookings=LocalProxy(lambda: cached_user_value(user_bookings, load_user_bookings, []))
+    )
+
+@app.template_global()
+def asset_url(endpoint, **values):
+    # Drop-in for url_for. Static files the asset build knows resolve to
+    # their fingerprinted build output; an image resolves to the best
+    # format the browser lists in Accept, at the smallest size at least
+    # `width` pixels wide. Anything else is plain url_for.
+    if endpoint == 'static':
+        resolved = assets.resolve(ASSETS, values['filename'], values.get('width'))
+        if resolved is not None:
+            filename, negotiated = resolved
+            if negotiated:
+                g.vary_accept = True
+            return url_for('asset', filename=filename)
+        values.pop('width', None)
+    return url_for(endpoint, **values)
+
+@app.after_request
+def vary_on_accept(response):
+    if g.get('vary_accept'):
+        response.vary.add('Accept')
+    return response
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    return assets.send_asset(ASSETS, filename, app.static_folder)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def parse_frontend_date(date_str):
+    try:
+        return datetime.strptime(date_str, '%d-%m-%Y').date()
+    except ValueError:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+
+def encode_cursor(departure, flight_id):
+    return base64.urlsafe_b64encode(f"{departure}|{flight_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    departure, flight_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+    return departure, int(flight_id)
+
+def fetch_flights_page(conn, cities=None, date=None, cursor=None, limit=FLIGHTS_PAGE_SIZE, route=None):
+    # Keyset pagination on (departure, id): every page is a range scan that
+    # starts where the previous one stopped, however deep the client goes.
+    # An exact route is an equality search on idx_flights_route_date;
+    # departure_date is a prefix of departure, so the order is the same.
+    # `cities` (normalized names, see CatalogSnapshot.matching_cities) is
+    # one equality range per city on idx_flights_origin and
+    # idx_flights_destination, merged here in the same order.
+    clauses, params = [], []
+    order = "departure, id"
+    if route:
+        clauses.append("route = ?")
+        params.append(migrations.route_value(*route))
+        order = "departure_date, departure, id"
+    if date and route:
+        clauses.append("departure_date = ?")
+        params.append(date.strftime('%Y-%m-%d'))
+    elif date:
+        clauses.append("departure >= ? AND departure < ?")
+        params += [date.strftime('%Y-%m-%d'), (date + timedelta(days=1)).strftime('%Y-%m-%d')]
+    if cursor:
+        clauses.append("(departure, id) > (?, ?)")
+        params += list(decode_cursor(cursor))
+    if cities is None:
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = conn.execute(
+            f"SELECT * FROM flights {where} ORDER BY {order} LIMIT ?", params + [limit + 1]
+        ).fetchall()
+    else:
+        ranges = [conn.execute(
+            f"SELECT * FROM flights WHERE {' AND '.join([f'{column} = ?'] + clauses)} ORDER BY {order} LIMIT ?",
+            [city] + params + [limit + 1]).fetchall()
+            for column in ('origin_key', 'destination_key') for city in cities]
+        rows, seen = [], set()
+        # A flight between two matching cities is in two ranges.
+        for row in heapq.merge(*ranges, key=lambda r: (r['departure'], r['id'])):
+            if row['id'] not in seen and len(rows) <= limit:
+                seen.add(row['id'])
+                rows.append(row)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['departure'], rows[-1]['id'])
+    return rows, next_cursor
+
+def flight_filters(args):
+    city = args.get('city', '').strip()
+    origin, destination = args.get('origin', '').strip(), args.get('destination', '').strip()
+    if bool(origin) != bool(destination):
+        raise ValueError("origin and destination go together")
+    route = (origin, destination) if origin else None
+    date = None
+    if args.get('date'):
+        date = parse_frontend_date(args['date'].strip())
+    elif args.get('q'):
+        # The free-text box on /home accepts either a city or a date.
+        term = args['q'].strip()
+        try:
+            date = parse_frontend_date(term)
+        except ValueError:
+            city = term
+    return city, date, route
+
+def cached_fragment(key, render):
+    html = fragments.get(key)
+    FRAGMENT_LOOKUPS.inc(key[0], 'miss' if html is None else 'hit')
+    if html is None:
+        html = Markup(render())
+        fragments.set(key, html)
+    return html
+
+def conditional_page(etag, last_modified, render):
+    # Only anonymous pages get validators: everything else on them depends
+    # on the catalog alone. A logged-in user's menu is rendered per request
+    # around the same cached fragments.
+    if session.get('user_id'):
+        return render()
+    if http_cache.not_modified(etag, last_modified):
+        return http_cache.set_validators(app.response_class(status=304), etag, last_modified)
+    return http_cache.set_validators(make_response(render()), etag, last_modified)
+
+def render_flight_listing():
+    with get_db_connection() as conn:
+        flights, next_cursor = fetch_flights_page(conn)
+    return render_template('_flight_listing.html', flights=flights, next_cursor=next_cursor)
+
 @app.route('/home')
 def home():
-    today = datetime.now().strftime(FRONTEND_DATE_FORMAT)
-    max_date = (datetime.now() + timedelta(days=MAX_BOOKING_DAYS)).strftime(FRONTEND_DATE_FORMAT)
-    with get_db_connection() as conn:
-        cities = conn.execute("SELECT DISTINCT origin FROM flights UNION SELECT DISTINCT destination FROM flights").fetchall()
-        flights = conn.execute("SELECT * FROM flights ORDER BY departure").fetchall()
-    return render_template(
-        'home.html',
-        min_date=today,
-        max_date=max_date,
-        cities=[city['origin'] for city in cities],
-        flights=flights
-    )
+    # The listing shows seat counts, so it is keyed on the global seat
+    # sequence as well as the catalog version.
+    version, seq, changed_at = get_catalog(app.config['DATABASE']).version()
+    etag = http_cache.make_etag('home', TEMPLATES_VERSION, version, seq)
+    return conditional_page(etag, changed_at, lambda: render_template(
+        'home.html', flight_listing=cached_fragment(('home', version, seq), render_flight_listing)))
+
+@app.route('/api/flights')
+def api_flights():
+    try:
+        city, date, route = flight_filters(request.args)
+        limit = min(max(int(request.args.get('limit', FLIGHTS_PAGE_SIZE)), 1), MAX_FLIGHTS_PAGE_SIZE)
+        # Free text matches city names as before, but is resolved to the
+        # cities it matches first, so a typo costs no query at all.
+        cities = get_catalog(app.config['DATABASE']).snapshot().matching_cities(city) if city else None
+        flights, next_cursor = fetch_flights_page(get_db_connection(), cities, date,
+                                                  request.args.get('cursor'), limit, route)
+    except (ValueError, binascii.Error):
+        return jsonify(error="Invalid filter or cursor"), 400
+    return jsonify(flights=[dict(f) for f in flights], next_cursor=next_cursor)
+
+def fare_calendar_dates(center=None, window=FARE_CALENDAR_WINDOW, month=None):
+    # Either center +/- window days or every day of month ('YYYY-MM'),
+    # clipped to the bookable range.
+    if month:
+        first = datetime.strptime(month, '%Y-%m').date()
+        last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    else:
+        window = min(max(window, 0), MAX_FARE_CALENDAR_WINDOW)
+        first, last = center - timedelta(days=window), center + timedelta(days=window)
+    today = datetime.now().date()
+    first = max(first, today)
+    last = min(last, today + timedelta(days=MAX_BOOKING_DAYS))
+    return [first + timedelta(days=n) for n in range((last - first).days + 1)]
+
+def fare_calendar(conn, origin, destination, dates, passengers=1):
+    days = get_catalog(app.config['DATABASE']).fare_calendar(
+        conn, origin, destination, [d.strftime('%Y-%m-%d') for d in dates], passengers)
+    return [dict(day._asdict(), label=d.strftime(FRONTEND_DATE_FORMAT)) for d, day in zip(dates, days)]
+
+@app.route('/api/fares')
+def api_fares():
+    origin = request.args.get('origin', '').strip()
+    destination = request.args.get('destination', '').strip()
+    if not origin or not destination:
+        return jsonify(error="origin and destination are required"), 400
+    try:
+        passengers = int(request.args.get('passengers', 1))
+        if request.args.get('month'):
+            dates = fare_calendar_dates(month=request.args['month'].strip())
+        else:
+            center = parse_frontend_date(request.args.get('date', '').strip())
+            dates = fare_calendar_dates(center, int(request.args.get('window', FARE_CALENDAR_WINDOW)))
+    except ValueError:
+        return jsonify(error="Invalid date, month, window or passengers"), 400
+    return jsonify(origin=origin, destination=destination, passengers=passengers,
+                   days=fare_calendar(get_db_connection(), origin, destination, dates, passengers))
 
 @app.route('/book-seat', methods=['POST'])
 def book_seat():
@@ -107,6 +368,7 @@ def book_seat():
     return redirect(url_for('home'))
 
 @app.route('/search', methods=['POST'])
+@admission.rate_limited(search_limiter)
 def search_results():
     origin = request.form.get('origin', '').strip()
     dest = request.form.get('destination', '').strip()
@@ -128,167 +390,219 @@ def search_results():
     except ValueError:
         flash("Invalid date format", "error")
         return redirect(url_for('home'))
-    with get_db_connection() as conn:
-        search_date_db = search_date.strftime('%Y-%m-%d')
-        flights = conn.execute('''
-            SELECT * FROM flights
-            WHERE LOWER(origin) = LOWER(?) AND LOWER(destination) = LOWER(?)
-            AND DATE(departure) = ?
-            AND seats >= ?
-            ORDER BY departure
-        ''', (origin.strip(), dest.strip(), search_date_db, passengers)).fetchall()
-    if not flights:
+    search_date_db = search_date.strftime('%Y-%m-%d')
+    sort = request.form.get('sort', 'arrival')
+    if sort not in itineraries.SORT_KEYS:
+        sort = 'arrival'
+    conn = get_db_connection()
+    catalog = get_catalog(app.config['DATABASE'])
+    flights = catalog.search(conn, origin, dest, search_date_db, passengers)
+    # Direct flights come from the catalog above; the route network adds
+    # itineraries with one or more connections.
+    network = itineraries.get_network(catalog)
+    connections = itineraries.with_live_seats(
+        conn, network.search(origin, dest, search_date_db, passengers, sort=sort, direct=False), passengers)
+    calendar = fare_calendar(conn, origin, dest, fare_calendar_dates(search_date), passengers)
+    if not flights and not connections and not any(day['price'] is not None for day in calendar):
         flash("No flights found for your search. Try changing date or cities.", "info")
         return redirect(url_for('home'))
-    return render_template('search_results.html', flights=flights, search_date=date_str,
+    return render_template('search_results.html', flights=flights, connections=connections, sort=sort,
+                           fare_calendar=calendar, search_date=date_str, search_date_db=search_date_db,
                            origin=origin, destination=dest, passengers=passengers)
 
 @app.route('/book/<int:flight_id>', methods=['GET', 'POST'])
+@admission.rate_limited(booking_limiter)
 def book(flight_id):
     if request.method == 'POST':
-        # --- DEBUG! print all input values to debug POST ---
-        print("BOOKING POST:", {k: v for k, v in request.form.items()})
         try:
             full_name = request.form.get('full_name')
             email = request.form.get('email')
             phone = request.form.get('phone')
             passport = request.form.get('passport')
             card_number = request.form.get('card_number', '').strip()
-            seat_number = request.form.get('selected_seat', '')
+            # A group sends one seat per passenger, comma-separated, and a
+            # name for every passenger after the first (the booker).
+            seat_numbers = [s.strip().upper() for s in request.form.get('selected_seat', '').split(',') if s.strip()]
+            passenger_names = [full_name] + [n.strip() for n in request.form.getlist('passenger_name')]
+            passengers = len(passenger_names)
+            retry = redirect(url_for('book', flight_id=flight_id, passengers=passengers if passengers > 1 else None))
 
             # Check all form fields, *including* seat selection!
-            if not all([full_name, email, phone, passport, card_number, seat_number]):
+            if not all([full_name, email, phone, passport, card_number, seat_numbers] + passenger_names):
                 flash("All fields including seat selection are required.", "error")
-                return redirect(url_for('book', flight_id=flight_id))
+                return retry
+            if passengers > MAX_GROUP_SIZE:
+                flash(f"A single booking can include at most {MAX_GROUP_SIZE} passengers.", "error")
+                return retry
+            if len(seat_numbers) != passengers:
+                flash(f"Please select one seat for each of the {passengers} passengers.", "error")
+                return retry
 
             if len(card_number) < 4:
                 flash('Invalid card number.', 'error')
-                return redirect(url_for('book', flight_id=flight_id))
+                return retry
             last4 = card_number[-4:]
 
-            with get_db_connection() as conn, get_admin_connection() as admin_conn, get_user_connection() as user_conn:
-                flight = conn.execute('SELECT * FROM flights WHERE id = ?', (flight_id,)).fetchone()
-                if not flight or flight['seats'] < 1:
-                    flash('Sorry, this flight is no longer available.', 'error')
-                    return redirect(url_for('home'))
-                taken_seats = conn.execute(
-                    'SELECT seat_number FROM bookings WHERE flight_id = ? AND seat_number = ?',
-                    (flight_id, seat_number)
+            conn = get_db_connection()
+            flight = conn.execute('SELECT * FROM flights WHERE id = ?', (flight_id,)).fetchone()
+            if not flight or flight['seats'] < passengers:
+                flash('Sorry, this flight is no longer available.', 'error')
+                return redirect(url_for('home'))
+            taken = set(seats.booked_seats(conn, flight_id)).intersection(seat_numbers)
+            if taken:
+                flash(f"Seat {', '.join(sorted(taken))} is already booked. Please choose another.", 'error')
+                return retry
+            user_id = session.get('user_id')
+            if not user_id:
+                existing_user = conn.execute(
+                    'SELECT id FROM users WHERE email = ? OR passport = ?', (email, passport)
                 ).fetchone()
-                if taken_seats:
-                    flash(f"Seat {seat_number} is already booked. Please choose another.", 'error')
-                    return redirect(url_for('book', flight_id=flight_id))
-                if session.get('user_id'):
-                    user_id = session['user_id']
-                else:
-                    existing_user = user_conn.execute(
-                        'SELECT id FROM users WHERE email = ? OR passport = ?', (email, passport)
-                    ).fetchone()
-                    if existing_user:
-                        user_id = existing_user['id']
-                    else:
-                        cur_user = user_conn.execute('''INSERT INTO users
+                if existing_user:
+                    user_id = existing_user['id']
+            booking_refs = [new_booking_ref() for _ in range(passengers)]
+            group_ref = new_booking_ref() if passengers > 1 else None
+            # users, bookings and payments live in three files attached to
+            # one connection, so the guest account, the seat compare-and-set,
+            # the bookings and their payments all land in a single commit,
+            # however many passengers there are.
+            try:
+                with booking_gate, db.immediate_transaction(conn):
+                    if not user_id:
+                        cur_user = conn.execute('''INSERT INTO users
                             (username, password_hash, full_name, email, phone, passport)
                             VALUES (?, ?, ?, ?, ?, ?)''',
-                            (email, generate_password_hash(str(random.randint(1000, 9999))),
-                             full_name, email, phone, passport))
-                        user_conn.commit()
+                            (email, passwords.UNUSABLE_PASSWORD, full_name, email, phone, passport))
                         user_id = cur_user.lastrowid
-                cur_booking = conn.execute('''INSERT INTO bookings
-                    (flight_id, user_id, booking_ref, payment_amount, seat_number)
-                    VALUES (?, ?, ?, ?, ?)''',
-                    (flight_id, user_id, f"BK{datetime.now().strftime('%Y%m%d')}{random.randint(1000,9999)}",
-                     flight['price'], seat_number))
-                conn.commit()
-                booking_id = cur_booking.lastrowid
-                booking_row = conn.execute(
-                    'SELECT id, booking_ref FROM bookings WHERE id = ?', (booking_id,)
-                ).fetchone()
-                booking_ref = booking_row['booking_ref']
-                admin_conn.execute('''INSERT INTO payments (booking_ref, amount, card_last4)
-                                       VALUES (?, ?, ?)''',
-                                    (booking_ref, flight['price'], last4))
-                admin_conn.commit()
-                conn.execute('UPDATE flights SET seats = seats - 1 WHERE id = ?', (flight_id,))
-                conn.commit()
-                # Generate ticket PDF
-                ticket_path = f"tickets/{booking_ref}.pdf"
-                os.makedirs("tickets", exist_ok=True)
-                c = canvas.Canvas(ticket_path, pagesize=letter)
-                c.setFont("Helvetica-Bold", 16)
-                c.drawString(100, 750, "PASSENGER NAME")
-                c.setFont("Helvetica", 14)
-                c.drawString(100, 730, full_name)
-                c.setFont("Helvetica-Bold", 16)
-                c.drawString(100, 700, "FLIGHT")
-                c.setFont("Helvetica", 14)
-                c.drawString(100, 680, flight['flight_no'])
-                c.setFont("Helvetica-Bold", 16)
-                c.drawString(100, 650, "SEAT")
-                c.setFont("Helvetica", 14)
-                c.drawString(100, 630, seat_number)
-                c.setFont("Helvetica-Bold", 16)
-                c.drawString(100, 600, f"{flight['origin']} → {flight['destination']}")
-                c.setFont("Helvetica", 10)
-                c.drawString(100, 400, f"Booking Ref: {booking_ref}")
-                c.save()
-                booking_for_template = {
-                    'id': booking_id,
-                    'booking_ref': booking_ref,
-                    'flight_no': flight['flight_no'],
-                    'date': flight['departure'],
-                    'seat': seat_number
-                }
-                user_for_template = None
-                try:
-                    with get_user_connection() as uconn:
-                        urow = uconn.execute(
-                            "SELECT id, username, full_name, email, phone, passport FROM users WHERE id = ?",
-                            (user_id,)
-                        ).fetchone()
-                        if urow:
-                            user_for_template = dict(urow)
-                except Exception:
-                    pass
-                return render_template('booking_confirmation.html',
-                                       booking=booking_for_template,
-                                       user=user_for_template)
+                    seats.claim_seats(conn, flight_id, seat_numbers)
+                    rows = [(flight_id, user_id, ref, group_ref, name, flight['price'], seat)
+                            for ref, name, seat in zip(booking_refs, passenger_names, seat_numbers)]
+                    booking_ids = {ref: booking_id for booking_id, ref in conn.execute(
+                        f'''INSERT INTO bookings
+                            (flight_id, user_id, booking_ref, group_ref, passenger_name, payment_amount, seat_number)
+                            VALUES {', '.join(['(?, ?, ?, ?, ?, ?, ?)'] * passengers)}
+                            RETURNING id, booking_ref''',
+                        [value for row in rows for value in row]).fetchall()}
+                    conn.executemany('''INSERT INTO payments (booking_ref, amount, card_last4)
+                                        VALUES (?, ?, ?)''',
+                                     [(ref, flight['price'], last4) for ref in booking_refs])
+            except seats.SeatUnavailable as e:
+                flash(str(e), 'error')
+                return retry
+            invalidate_user_cache(user_id)
+            if group_ref:
+                ticket_queue.submit(group_ref, flight['flight_no'], flight['origin'], flight['destination'],
+                                    list(zip(passenger_names, seat_numbers, booking_refs)),
+                                    job=tickets.timed_render_group_ticket)
+            else:
+                ticket_queue.submit(booking_refs[0], full_name, flight['flight_no'], seat_numbers[0],
+                                    flight['origin'], flight['destination'])
+            booking_for_template = {
+                'id': booking_ids[booking_refs[0]],
+                'ticket_token': ticket_links.dumps(booking_ids[booking_refs[0]]),
+                'booking_ref': group_ref or booking_refs[0],
+                'flight_no': flight['flight_no'],
+                'date': flight['departure'],
+                'seat': ', '.join(seat_numbers),
+                'passengers': [{'name': name, 'seat': seat, 'booking_ref': ref}
+                               for name, seat, ref in zip(passenger_names, seat_numbers, booking_refs)],
+            }
+            user_for_template = None
+            can_claim = False
+            try:
+                with get_user_connection() as uconn:
+                    urow = uconn.execute(
+                        "SELECT id, username, full_name, email, phone, passport, password_hash FROM users WHERE id = ?",
+                        (user_id,)
+                    ).fetchone()
+                    if urow:
+                        user_for_template = dict(urow)
+                        can_claim = not passwords.is_usable(user_for_template.pop('password_hash'))
+            except Exception:
+                pass
+            return render_template('booking_confirmation.html',
+                                   booking=booking_for_template,
+                                   user=user_for_template,
+                                   can_claim=can_claim)
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"Error during booking: {str(e)}")
+            app.logger.exception("Error during booking: %s", e)
             flash('An error occurred during booking. Please try again.', 'error')
             return redirect(url_for('book', flight_id=flight_id))
 
-    with get_db_connection() as conn:
-        flight = conn.execute('SELECT * FROM flights WHERE id = ?', (flight_id,)).fetchone()
-        booked = conn.execute(
-            'SELECT seat_number FROM bookings WHERE flight_id = ? AND seat_number IS NOT NULL',
-            (flight_id,)
-        ).fetchall()
-        booked_seats = [row['seat_number'] for row in booked]
-    return render_template('booking_form.html', flight=flight,
-                           booked_seats=booked_seats,
-                           selected_seat=session.get('selected_seat'))
+    version, seq, changed_at = get_catalog(app.config['DATABASE']).flight_version(flight_id)
+    selected_seat = session.get('selected_seat')
+    passengers = min(max(request.args.get('passengers', 1, type=int), 1), MAX_GROUP_SIZE)
+    etag = http_cache.make_etag('book', TEMPLATES_VERSION, flight_id, version, seq, selected_seat, passengers)
+
+    def render_seat_map():
+        with get_db_connection() as conn:
+            booked_seats = seats.booked_seats(conn, flight_id)
+        return render_template('_seat_map.html', booked_seats=booked_seats, selected_seat=selected_seat)
+
+    return conditional_page(etag, changed_at, lambda: render_template(
+        'booking_form.html', passengers=passengers,
+        seat_map=cached_fragment(('seat_map', flight_id, version, seq, selected_seat), render_seat_map)))
 
 @app.route('/tickets/<filename>')
 def get_ticket(filename):
     return send_from_directory('tickets', filename)
 
+# Booking ids are sequential, so the id alone proves nothing: a ticket is
+# served to the account that owns it, to an admin, or to whoever holds the
+# signed link from the confirmation page (guests have no login to check).
+ticket_links = URLSafeSerializer(app.secret_key, salt='download-ticket')
+
+def may_download(booking_id, owner_id):
+    if session.get('admin') or (owner_id and session.get('user_id') == owner_id):
+        return True
+    try:
+        return ticket_links.loads(request.args.get('token', '')) == booking_id
+    except BadSignature:
+        return False
+
 @app.route('/download_ticket/<int:booking_id>')
 def download_ticket(booking_id):
     try:
         with get_db_connection() as conn:
-            b = conn.execute('SELECT booking_ref FROM bookings WHERE id = ?', (booking_id,)).fetchone()
-            if not b:
+            b = conn.execute('''
+                SELECT b.booking_ref, b.group_ref, b.passenger_name, b.user_id, b.seat_number,
+                       f.flight_no, f.origin, f.destination
+                FROM bookings b
+                JOIN flights f ON f.id = b.flight_id
+                WHERE b.id = ?
+            ''', (booking_id,)).fetchone()
+            if not b or not may_download(booking_id, b['user_id']):
                 flash("Booking not found.", "error")
                 return redirect(url_for('home'))
-            filename = f"{b['booking_ref']}.pdf"
-            filepath = os.path.join('tickets', filename)
-            if not os.path.exists(filepath):
-                flash("Ticket file not found.", "error")
-                return redirect(url_for('home'))
-            return send_from_directory('tickets', filename, as_attachment=True)
+        # Every booking in a group downloads the group's combined ticket.
+        booking_ref = b['group_ref'] or b['booking_ref']
+        filename = f"{booking_ref}.pdf"
+        status = ticket_queue.status(booking_ref)
+        if status == tickets.PENDING:
+            ticket_queue.wait(booking_ref, TICKET_WAIT_SECONDS)
+        if not os.path.exists(tickets.ticket_path(booking_ref)):
+            # The job is still running, failed, or belonged to another
+            # process: render the ticket here instead of making the user retry.
+            render_started = time.perf_counter()
+            if b['group_ref']:
+                with get_db_connection() as conn:
+                    group = conn.execute('''SELECT passenger_name, seat_number, booking_ref FROM bookings
+                                            WHERE group_ref = ? ORDER BY id''', (b['group_ref'],)).fetchall()
+                tickets.render_group_ticket(booking_ref, b['flight_no'], b['origin'], b['destination'],
+                                            [tuple(row) for row in group])
+            else:
+                full_name = b['passenger_name']
+                if not full_name:
+                    with get_user_connection() as uconn:
+                        user = uconn.execute('SELECT full_name FROM users WHERE id = ?', (b['user_id'],)).fetchone()
+                    full_name = user['full_name'] if user else ''
+                tickets.render_ticket(booking_ref, full_name, b['flight_no'],
+                                      b['seat_number'] or '', b['origin'], b['destination'])
+            metrics.observe_ticket('inline', time.perf_counter() - render_started)
+        return send_from_directory(tickets.TICKETS_DIR, filename, as_attachment=True)
     except Exception as e:
-        print("Error serving ticket:", e)
+        app.logger.exception("Error serving ticket: %s", e)
         flash("An error occurred while fetching the ticket.", "error")
         return redirect(url_for('home'))
 
@@ -310,18 +624,22 @@ def register():
             return redirect(url_for('register'))
         with get_user_connection() as conn:
             existing = conn.execute(
-                "SELECT id FROM users WHERE username = ? OR email = ? OR passport = ?",
+                "SELECT id, password_hash FROM users WHERE username = ? OR email = ? OR passport = ?",
                 (username, email, passport)
             ).fetchone()
+            if existing and not passwords.is_usable(existing['password_hash']):
+                flash("You booked with these details as a guest. Set a password to claim that account.", "info")
+                return redirect(url_for('claim_account'))
             if existing:
                 flash("An account with these details already exists. Try logging in.", "error")
                 return redirect(url_for('register'))
-            pw_hash = generate_password_hash(password)
+            pw_hash = passwords.hash_password(password)
             cur = conn.execute('''INSERT INTO users
                 (username, password_hash, full_name, email, phone, passport)
                 VALUES (?, ?, ?, ?, ?, ?)''',
                 (username, pw_hash, full_name, email, phone, passport))
             conn.commit()
+            invalidate_user_cache(cur.lastrowid)
             session['user_id'] = cur.lastrowid
             flash("Registration successful. You are now logged in.", "success")
             return redirect(url_for('home'))
@@ -338,7 +656,10 @@ def login():
                 "SELECT * FROM users WHERE email = ? OR username = ?",
                 (email_or_username, email_or_username)
             ).fetchone()
-            if user and check_password_hash(user['password_hash'], password):
+            if user and not passwords.is_usable(user['password_hash']):
+                flash("This account was created during a guest booking. Set a password to claim it.", "info")
+                return redirect(url_for('claim_account'))
+            if user and passwords.check_password(user['password_hash'], password):
                 session['user_id'] = user['id']
                 if remember:
                     session.permanent = True
@@ -350,6 +671,45 @@ def login():
                 return redirect(url_for('login'))
     return render_template('login.html')
 
+# Guest checkouts create an account with an unusable password instead of
+# hashing a throwaway one. The owner claims it later by proving they hold
+# one of its bookings, and only then is a real password hashed.
+@app.route('/claim', methods=['GET', 'POST'])
+@admission.rate_limited(claim_limiter)
+def claim_account():
+    if request.method == 'POST':
+        email = request.form.get('email', '').strip()
+        booking_ref = request.form.get('booking_ref', '').strip().upper()
+        password = request.form.get('password', '')
+        password2 = request.form.get('password2', '')
+        if not all([email, booking_ref, password, password2]):
+            flash("Please fill in all required fields.", "error")
+            return redirect(url_for('claim_account'))
+        if password != password2:
+            flash("Passwords do not match.", "error")
+            return redirect(url_for('claim_account'))
+        with get_user_connection() as conn:
+            user = conn.execute('''
+                SELECT u.id, u.password_hash FROM users u
+                JOIN bookings b ON b.user_id = u.id
+                WHERE u.email = ? AND (b.booking_ref = ? OR b.group_ref = ?)
+            ''', (email, booking_ref, booking_ref)).fetchone()
+            if not user or passwords.is_usable(user['password_hash']):
+                flash("No unclaimed guest account matches that email and booking reference.", "error")
+                return redirect(url_for('claim_account'))
+            pw_hash = passwords.hash_password(password)
+            cur = conn.execute("UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+                               (pw_hash, user['id'], passwords.UNUSABLE_PASSWORD))
+            conn.commit()
+            if cur.rowcount != 1:
+                flash("This account has already been claimed. Try logging in.", "error")
+                return redirect(url_for('login'))
+            invalidate_user_cache(user['id'])
+            session['user_id'] = user['id']
+            flash("Account claimed. You are now logged in.", "success")
+            return redirect(url_for('home'))
+    return render_template('claim_account.html')
+
 @app.route('/logout')
 def logout():
     session.pop('user_id', None)
@@ -361,7 +721,7 @@ def admin_login():
     if request.method == 'POST':
         username = request.form.get('username').strip()
         password = request.form.get('password')
-        if username in ADMINS and check_password_hash(ADMINS[username], password):
+        if username in ADMINS and passwords.check_password(ADMINS[username], password):
             session['admin'] = username
             flash('Login successful', 'success')
             return redirect(url_for('admin_dashboard'))
@@ -373,17 +733,36 @@ def admin_login():
 def admin_dashboard():
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
-    with get_db_connection() as conn, get_admin_connection() as admin_conn, get_user_connection() as user_conn:
-        stats = {
-            'flights': conn.execute("SELECT COUNT(*) FROM flights").fetchone()[0],
-            'bookings': conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0],
-            'users': user_conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
-            'revenue': admin_conn.execute("SELECT SUM(amount) FROM payments").fetchone()[0] or 0
-        }
-        recent_bookings = admin_conn.execute(
+    with get_db_connection() as conn:
+        dashboard_stats = stats.read_stats(conn)
+        recent_bookings = conn.execute(
             'SELECT * FROM payments ORDER BY payment_date DESC LIMIT 5'
         ).fetchall()
-    return render_template('admin_dashboard.html', stats=stats, bookings=recent_bookings, admin=session.get('admin'))
+    return render_template('admin_dashboard.html', stats=dashboard_stats, bookings=recent_bookings, admin=session.get('admin'))
+
+@app.route('/admin/export.<fmt>')
+def admin_export(fmt):
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    if fmt not in export.FORMATS:
+        return jsonify(error="Unknown export format"), 404
+    try:
+        start, end, after = export.parse_filters(request.args)
+    except ValueError:
+        return jsonify(error="Invalid start, end or after"), 400
+    try:
+        after = export.resume_point(get_db_connection(), after) if after else None
+    except LookupError:
+        return jsonify(error=f"No booking {after} to resume after"), 400
+    # The stream outlives this request, so it borrows its own connection
+    # from the pool instead of the per-request one.
+    pool = db.get_pool(app.config['DATABASE'],
+                       attach={'admin': app.config['ADMIN_DB'], 'users': app.config['USERS_DB']},
+                       migrate=migrations.migrate)
+    stream, mimetype = export.FORMATS[fmt]
+    filename = f"bookings-{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    return Response(stream(export.iter_batches(pool, start, end, after)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @app.route('/admin/logout')
 def admin_logout():
@@ -396,4 +775,7 @@ if __name__ == '__main__':
     os.makedirs('templates', exist_ok=True)
     os.makedirs('static', exist_ok=True)
     os.makedirs('tickets', exist_ok=True)
-    app.run(host="0.0.0.0", port=port, debug=True)
+    # WEB_WORKERS / WEB_THREADS size the server; see serve.py. For local
+    # development with the reloader: flask --app app run --debug
+    import serve
+    serve.run(app, port=port)
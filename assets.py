@@ -0,0 +1,214 @@
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_from_directory
+from werkzeug.exceptions import NotFound
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+TEXT_EXTENSIONS = ('.css', '.js', '.html', '.svg', '.json', '.txt')
+# Backgrounds are full-bleed, so the variants cover phones to large
+# desktops; an image is never scaled up past its own width.
+WIDTHS = (640, 1280, 1920)
+# Best first. The fallback format (JPEG, or PNG for images with alpha) is
+# always built and always last.
+IMAGE_FORMATS = (
+    ('avif', 'image/avif', {'quality': 55, 'speed': 6}),
+    ('webp', 'image/webp', {'quality': 78, 'method': 6}),
+)
+FALLBACK_FORMATS = {
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'png': ('png', {'optimize': True}),
+}
+# Compressing a file smaller than this costs more in headers than it saves.
+MIN_COMPRESS_SIZE = 512
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def _write(out_dir, stem, ext, data):
+    name = f"{stem}.{fingerprint(data)}.{ext}"
+    with open(os.path.join(out_dir, name), 'wb') as f:
+        f.write(data)
+    return name
+
+
+def _encode(image, fmt, options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def build_image(path, out_dir):
+    # Pillow is only needed to build, not to serve.
+    from PIL import Image, features
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with Image.open(path) as source:
+        has_alpha = source.mode in ('RGBA', 'LA') or 'transparency' in source.info
+        image = source.convert('RGBA' if has_alpha else 'RGB')
+    fallback = 'png' if has_alpha else 'jpeg'
+    formats = [(fmt, mimetype, options) for fmt, mimetype, options in IMAGE_FORMATS if features.check(fmt)]
+    fallback_ext, fallback_options = FALLBACK_FORMATS[fallback]
+    formats.append((fallback, mimetypes.types_map['.' + fallback_ext], fallback_options))
+
+    widths = sorted({w for w in WIDTHS if w < image.width} | {min(image.width, max(WIDTHS))})
+    variants = []
+    for fmt, mimetype, options in formats:
+        ext = fallback_ext if fmt == fallback else fmt
+        sizes = []
+        for width in widths:
+            height = round(image.height * width / image.width)
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            sizes.append([width, _write(out_dir, f"{stem}-{width}", ext, _encode(resized, fmt.upper(), options))])
+        variants.append({'type': mimetype, 'sizes': sizes})
+    return {'width': image.width, 'height': image.height, 'variants': variants}
+
+
+def precompress(out_dir, name):
+    with open(os.path.join(out_dir, name), 'rb') as f:
+        data = f.read()
+    encodings = []
+    if len(data) < MIN_COMPRESS_SIZE:
+        return encodings
+    compressed = {'gzip': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        compressed['br'] = brotli.compress(data, quality=11)
+    for encoding, suffix in ENCODINGS:
+        body = compressed.get(encoding)
+        if body is not None and len(body) < len(data):
+            with open(os.path.join(out_dir, name + suffix), 'wb') as f:
+                f.write(body)
+            encodings.append(encoding)
+    return encodings
+
+
+def build(static_dir=STATIC_DIR, log=None):
+    # Rebuilds static/dist from scratch: resized, fingerprinted image
+    # variants, fingerprinted and precompressed text assets, and the
+    # manifest the app loads at startup.
+    out_dir = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    manifest = {'images': {}, 'files': {}, 'encodings': {}}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != out_dir)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            ext = os.path.splitext(name)[1].lower()
+            if ext in IMAGE_EXTENSIONS:
+                manifest['images'][rel] = entry = build_image(path, out_dir)
+                if log is not None:
+                    log(f"{rel}: {sum(len(v['sizes']) for v in entry['variants'])} variants")
+            elif ext in TEXT_EXTENSIONS:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                stem = os.path.splitext(rel.replace('/', '-'))[0]
+                manifest['files'][rel] = built = _write(out_dir, stem, ext[1:], data)
+                encodings = precompress(out_dir, built)
+                if encodings:
+                    manifest['encodings'][built] = encodings
+                if log is not None:
+                    log(f"{rel}: {built} {' '.join(encodings)}")
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+def served_names(manifest):
+    # Every fingerprinted name the build produced. Only these are safe to
+    # cache forever; anything else in dist (the manifest itself, a stale
+    # file) is not served from /assets at all.
+    names = set(manifest['files'].values())
+    for entry in manifest['images'].values():
+        names.update(name for variant in entry['variants'] for _, name in variant['sizes'])
+    return names
+
+
+def load_manifest(static_dir=STATIC_DIR):
+    # No manifest (the build hasn't run) means every static file is served
+    # as is through Flask's static route.
+    path = os.path.join(static_dir, DIST_DIR, MANIFEST)
+    manifest = {'images': {}, 'files': {}, 'encodings': {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+    manifest['names'] = served_names(manifest)
+    return manifest
+
+
+def accepts(mimetype):
+    # Only an explicit listing counts: browsers send */* for everything, and
+    # a browser that can't decode AVIF must never be handed AVIF.
+    return any(value == mimetype and quality > 0 for value, quality in request.accept_mimetypes)
+
+
+def resolve(manifest, filename, width=None):
+    # (built file name, whether the choice depended on the Accept header),
+    # or None if the build doesn't know the file.
+    if filename in manifest['files']:
+        return manifest['files'][filename], False
+    entry = manifest['images'].get(filename)
+    if entry is None:
+        return None
+    variants = entry['variants']
+    chosen = next((v for v in variants[:-1] if accepts(v['type'])), variants[-1])
+    sizes = chosen['sizes']
+    # The smallest variant at least as wide as asked for, else the largest.
+    name = next((n for w, n in sizes if width is not None and w >= width), sizes[-1][1])
+    return name, len(variants) > 1
+
+
+def send_asset(manifest, filename, static_dir=STATIC_DIR):
+    if filename not in manifest['names']:
+        raise NotFound()
+    directory = os.path.join(static_dir, DIST_DIR)
+    encodings = manifest['encodings'].get(filename, ())
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in ENCODINGS:
+        if encoding in encodings and request.accept_encodings[encoding]:
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetype)
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype)
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    # The name changes whenever the content does, so a cached copy never
+    # needs revalidating.
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    response.cache_control.no_cache = None
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build static/dist: resized, fingerprinted and precompressed assets.")
+    parser.add_argument('--static-dir', default=STATIC_DIR)
+    args = parser.parse_args()
+    manifest = build(args.static_dir, log=print)
+    print(f"{len(manifest['images'])} images, {len(manifest['files'])} files -> "
+          f"{os.path.join(args.static_dir, DIST_DIR, MANIFEST)}")
+
+
+if __name__ == '__main__':
+    main()
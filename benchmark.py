@@ -0,0 +1,260 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import g
+
+from scratch import scratch_app
+from seats import SEAT_COLS, SEAT_ROWS, seat_label
+
+ALL_SEATS = [seat_label(bit) for bit in range(SEAT_ROWS * SEAT_COLS)]
+# Relative weights of each route in the mixed workload.
+ROUTE_MIX = {
+    'GET /home': 20,
+    'POST /search': 30,
+    'GET /book/<id>': 20,
+    'POST /book/<id>': 5,
+    'POST /login': 5,
+    'GET /download_ticket/<id>': 10,
+    'GET /admin/dashboard': 5,
+    'GET /api/flights': 5,
+}
+# Set on every response by count_queries(): SQL statements the request ran.
+QUERY_HEADER = 'X-Benchmark-Queries'
+SAMPLE_USER = ('john_doe', 'Travel@123')
+ADMIN_USER = ('Suhas J', 'Suhas@123')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drive the app's routes with mixed traffic and report latency per route.")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000, help="total requests across all threads")
+    parser.add_argument('--flights', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help="where to write this run's JSON")
+    parser.add_argument('--baseline', help="JSON from an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed relative regression in p95 latency or throughput before failing; "
+                             "any rise in SQL statements per request fails regardless")
+    return parser.parse_args(argv)
+
+
+def count_queries(response):
+    # Registered after metrics.init_app, so Flask runs it first, while the
+    # statements metrics collected for this request are still on g.
+    response.headers[QUERY_HEADER] = str(len(g.get('_queries') or ()))
+    return response
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+class Workload:
+    def __init__(self, app, db_path, seed):
+        self.app = app
+        self.rng = random.Random(seed)
+        conn = sqlite3.connect(db_path)
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        self.searches = conn.execute('''
+            SELECT origin, destination, substr(departure, 1, 10) FROM flights
+            WHERE departure >= ? ORDER BY random() LIMIT 500
+        ''', (tomorrow,)).fetchall()
+        self.flight_ids = [r[0] for r in conn.execute(
+            'SELECT id FROM flights WHERE departure >= ? ORDER BY random() LIMIT 2000', (tomorrow,))]
+        self.booking_ids = [r[0] for r in conn.execute('SELECT id FROM bookings ORDER BY random() LIMIT 500')]
+        conn.close()
+        self.guest_counter = 0
+        self.lock = threading.Lock()
+
+    def next_guest(self):
+        with self.lock:
+            self.guest_counter += 1
+            return self.guest_counter
+
+    def request(self, client, route, rng):
+        if route == 'GET /home':
+            return client.get('/home')
+        if route == 'GET /api/flights':
+            return client.get('/api/flights', query_string={'q': rng.choice(self.searches)[0]})
+        if route == 'POST /search':
+            origin, destination, day = rng.choice(self.searches)
+            return client.post('/search', data={'origin': origin, 'destination': destination,
+                                                'date': day, 'passengers': '1'})
+        if route == 'GET /book/<id>':
+            return client.get(f'/book/{rng.choice(self.flight_ids)}')
+        if route == 'POST /book/<id>':
+            n = self.next_guest()
+            return client.post(f'/book/{rng.choice(self.flight_ids)}', data={
+                'full_name': f'Bench Guest {n}', 'email': f'bench-{n}@example.com', 'phone': '5550000',
+                'passport': f'9{n:07d}', 'card_number': '4111111111111111',
+                'selected_seat': rng.choice(ALL_SEATS)})
+        if route == 'POST /login':
+            return client.post('/login', data={'email_or_username': SAMPLE_USER[0], 'password': SAMPLE_USER[1]})
+        if route == 'GET /download_ticket/<id>':
+            return client.get(f'/download_ticket/{rng.choice(self.booking_ids)}')
+        if route == 'GET /admin/dashboard':
+            return client.get('/admin/dashboard')
+        raise ValueError(route)
+
+
+def worker(workload, requests, seed, samples, lock):
+    rng = random.Random(seed)
+    client = workload.app.test_client()
+    client.post('/admin/login', data={'username': ADMIN_USER[0], 'password': ADMIN_USER[1]})
+    routes, weights = zip(*ROUTE_MIX.items())
+    local = {route: {'latencies': [], 'queries': [], 'errors': 0, 'overloaded': 0} for route in routes}
+    for _ in range(requests):
+        route = rng.choices(routes, weights)[0]
+        started = time.perf_counter()
+        response = workload.request(client, route, rng)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        sample = local[route]
+        # Turned away by a rate limit or a concurrency gate: fast, but not
+        # the route doing its work, so kept out of the latencies.
+        if response.status_code in (429, 503):
+            sample['overloaded'] += 1
+            continue
+        if response.status_code >= 500:
+            sample['errors'] += 1
+        sample['latencies'].append(elapsed)
+        sample['queries'].append(int(response.headers.get(QUERY_HEADER, 0)))
+    with lock:
+        for route in routes:
+            for key in ('latencies', 'queries'):
+                samples[route][key].extend(local[route][key])
+            for key in ('errors', 'overloaded'):
+                samples[route][key] += local[route][key]
+
+
+def summarize(samples, elapsed):
+    routes = {}
+    for route, sample in samples.items():
+        latencies = sorted(sample['latencies'])
+        if not latencies:
+            continue
+        queries = sorted(sample['queries'])
+        routes[route] = {
+            'count': len(latencies),
+            'errors': sample['errors'],
+            'overloaded': sample['overloaded'],
+            'throughput': len(latencies) / elapsed,
+            'queries_p50': percentile(queries, 50),
+            'queries_max': queries[-1],
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        }
+    return routes
+
+
+def compare(routes, baseline, tolerance):
+    regressions = []
+    for route, current in routes.items():
+        previous = baseline.get('routes', {}).get(route)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+        if current['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(f"{route}: throughput {previous['throughput']:.1f}/s -> {current['throughput']:.1f}/s")
+        # Statement counts don't depend on the machine: no tolerance.
+        for key in ('queries_p50', 'queries_max'):
+            if key in previous and current[key] > previous[key]:
+                regressions.append(f"{route}: {key} {previous[key]} -> {current[key]}")
+        for key in ('errors', 'overloaded'):
+            if current[key] > previous.get(key, 0):
+                regressions.append(f"{route}: {key} {previous.get(key, 0)} -> {current[key]}")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    started = time.perf_counter()
+    # All traffic comes from one address; measure the routes, not the
+    # per-client rate limits. Likewise every thread gets its own password
+    # hashing slot, so /login is timed without the hash gate's queue.
+    app_module, workdir = scratch_app(
+        'benchmark-',
+        ['--flights', str(args.flights), '--users', str(args.users), '--bookings', str(args.bookings),
+         '--schedule', 'random', '--seed', str(args.seed), '--start-date', datetime.now().strftime('%Y-%m-%d')],
+        env={'SEARCH_BURST': args.requests, 'BOOKING_BURST': args.requests,
+             'HASH_WORKERS': args.threads, 'HASH_QUEUE': args.threads, 'HASH_QUEUE_TIMEOUT': 60})
+    print(f"dataset: {args.flights} flights, {args.users} users, {args.bookings} bookings "
+          f"({time.perf_counter() - started:.1f}s, in {workdir})")
+    app = app_module.app
+    workload = Workload(app, app.config['DATABASE'], args.seed)
+
+    app.after_request(count_queries)
+    samples = {route: {'latencies': [], 'queries': [], 'errors': 0, 'overloaded': 0} for route in ROUTE_MIX}
+    lock = threading.Lock()
+    per_thread = args.requests // args.threads
+    threads = [threading.Thread(target=worker, args=(workload, per_thread, args.seed * 1000 + n, samples, lock))
+               for n in range(args.threads)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.perf_counter() - started
+    app_module.ticket_queue.shutdown()
+
+    routes = summarize(samples, elapsed)
+    total = sum(r['count'] for r in routes.values())
+    print(f"{total} requests from {args.threads} threads in {elapsed:.2f}s ({total / elapsed:.1f} req/s)")
+    print(f"{'route':<28}{'count':>7}{'err':>5}{'busy':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'sql':>5}{'max':>5}")
+    for route, r in routes.items():
+        print(f"{route:<28}{r['count']:>7}{r['errors']:>5}{r['overloaded']:>6}{r['throughput']:>9.1f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['queries_p50']:>5}{r['queries_max']:>5}")
+
+    result = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'threads': args.threads,
+            'requests': total,
+            'elapsed_s': elapsed,
+            'dataset': {'flights': args.flights, 'users': args.users, 'bookings': args.bookings, 'seed': args.seed},
+        },
+        'routes': routes,
+    }
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"wrote {output}")
+
+    if baseline is not None:
+        regressions = compare(routes, baseline, args.tolerance)
+        if regressions:
+            print(f"REGRESSIONS (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
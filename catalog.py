@@ -0,0 +1,191 @@
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import migrations
+
+Flight = namedtuple('Flight', 'id flight_no origin destination departure arrival price seats airline')
+FareDay = namedtuple('FareDay', 'date price seats flights')
+
+def route_key(origin, destination):
+    return origin.strip().lower(), destination.strip().lower()
+
+
+class CatalogSnapshot:
+    def __init__(self, version, flights):
+        self.version = version
+        self.flights = {}
+        by_route_date = {}
+        for flight in flights:
+            self.flights[flight.id] = flight
+            key = route_key(flight.origin, flight.destination) + (flight.departure[:10],)
+            by_route_date.setdefault(key, []).append(flight)
+        for day in by_route_date.values():
+            day.sort(key=lambda f: (f.departure, f.id))
+        self.by_route_date = {key: tuple(day) for key, day in by_route_date.items()}
+        self.cities = tuple(sorted({city for key in by_route_date for city in key[:2]}))
+
+    def lookup(self, origin, destination, date_str):
+        return self.by_route_date.get(route_key(origin, destination) + (date_str,), ())
+
+    def matching_cities(self, term):
+        # Normalized names of every city served that contains `term`.
+        term = term.strip().lower()
+        return [city for city in self.cities if term in city]
+
+
+# The catalog's version comes from catalog_meta and flight_versions, kept
+# by triggers on flights (migration main 8): the version moves with
+# schedule and fare changes, the per-flight sequence with seat changes.
+class FlightCatalog:
+    def __init__(self, path):
+        self.path = path
+        self._snapshot = None
+        self._data_version = None
+        self._db_version = None
+        self._changed_at = time.time()
+        self._flight_seqs = {}
+        self._last_seq = 0
+        self._seq_changed_at = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+
+    def _connection(self):
+        # A dedicated connection: PRAGMA data_version only reports commits
+        # made by *other* connections, which is every app write.
+        if self._conn is None:
+            migrations.migrate({'main': self.path})
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        return self._conn
+
+    def close(self):
+        # PRAGMA data_version is only comparable within one connection, so
+        # the next refresh starts over from catalog_meta and the snapshot
+        # is kept only if its version still matches.
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._data_version = None
+
+    def _refresh(self):
+        # Called with self._lock held. Table reads only happen after some
+        # other connection has committed; otherwise this is one PRAGMA.
+        conn = self._connection()
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        now = time.time()
+        db_version = conn.execute('SELECT version FROM catalog_meta WHERE id = 1').fetchone()[0]
+        if db_version != self._db_version:
+            self._db_version = db_version
+            self._changed_at = now
+        for flight_id, seq in conn.execute('SELECT flight_id, seq FROM flight_versions WHERE seq > ?',
+                                           (self._last_seq,)):
+            self._flight_seqs[flight_id] = (seq, now)
+            self._last_seq = max(self._last_seq, seq)
+            self._seq_changed_at = now
+
+    def _current_version(self):
+        with self._lock:
+            self._refresh()
+            return self._db_version
+
+    def version(self):
+        # (catalog version, seat-change sequence, when this process first
+        # saw that state); the sequence moves on any booking anywhere.
+        with self._lock:
+            self._refresh()
+            return self._db_version, self._last_seq, max(self._changed_at, self._seq_changed_at)
+
+    def flight_version(self, flight_id):
+        with self._lock:
+            self._refresh()
+            seq, changed_at = self._flight_seqs.get(flight_id, (0, 0))
+            return self._db_version, seq, max(changed_at, self._changed_at)
+
+    def _load(self, version):
+        intern = sys.intern
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute(
+                'SELECT id, flight_no, origin, destination, departure, arrival, price, seats, airline FROM flights'
+            )
+            flights = [Flight(r[0], r[1], intern(r[2]), intern(r[3]), r[4], r[5], r[6], r[7], intern(r[8]))
+                       for r in rows]
+        finally:
+            conn.close()
+        return CatalogSnapshot(version, flights)
+
+    def snapshot(self):
+        version = self._current_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        # Only one thread rebuilds; the others keep serving the previous
+        # snapshot rather than queueing behind a full table read.
+        if not self._rebuild_lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self._load(version)
+            return self._snapshot
+        finally:
+            self._rebuild_lock.release()
+
+    def _live_seats(self, conn, flights):
+        # Seat counts change with every booking, so they are read live by
+        # primary key instead of invalidating the whole snapshot.
+        placeholders = ','.join('?' * len(flights))
+        return dict(conn.execute(
+            f'SELECT id, seats FROM flights WHERE id IN ({placeholders})',
+            [f.id for f in flights]
+        ).fetchall())
+
+    def search(self, conn, origin, destination, date_str, passengers=1):
+        candidates = self.snapshot().lookup(origin, destination, date_str)
+        if not candidates:
+            return []
+        seats = self._live_seats(conn, candidates)
+        return [f._replace(seats=seats[f.id]) for f in candidates
+                if seats.get(f.id, 0) >= passengers]
+
+    def fare_calendar(self, conn, origin, destination, dates, passengers=1):
+        # Cheapest bookable fare per day: one dict lookup per day in the
+        # snapshot's route/date index and one batched seat read for all of
+        # them, rather than a search per date.
+        snapshot = self.snapshot()
+        by_day = [(day, snapshot.lookup(origin, destination, day)) for day in dates]
+        candidates = [f for _, flights in by_day for f in flights]
+        seats = self._live_seats(conn, candidates) if candidates else {}
+        calendar = []
+        for day, flights in by_day:
+            available = [f for f in flights if seats.get(f.id, 0) >= passengers]
+            if not available:
+                calendar.append(FareDay(day, None, 0, 0))
+                continue
+            cheapest = min(available, key=lambda f: (f.price, f.departure))
+            calendar.append(FareDay(day, cheapest.price, seats[cheapest.id], len(available)))
+        return calendar
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(path):
+    catalog = _catalogs.get(path)
+    if catalog is None:
+        with _catalogs_lock:
+            catalog = _catalogs.setdefault(path, FlightCatalog(path))
+    return catalog
+
+
+def close_catalogs():
+    with _catalogs_lock:
+        for catalog in _catalogs.values():
+            catalog.close()
@@ -1,18 +1,71 @@
+import argparse
+import random
 import sqlite3
+from array import array
 from datetime import datetime, timedelta
+from itertools import islice
 from werkzeug.security import generate_password_hash
 
+import migrations
+from seats import SEAT_COLS, SEAT_ROWS, seat_label
+
 DB_PATH = "flights.db"
 ADMIN_DB = "admin.db"
 USERS_DB = "users.db"
 FLIGHT_INFO_PATH = "flights_info.txt"
 
-def initialize_flights_db():
-    conn = sqlite3.connect(DB_PATH)
+BATCH_SIZE = 10000
+SEATS_PER_FLIGHT = 100
+BOOKING_WINDOW_DAYS = 365
+CITIES = ['Bangalore', 'London', 'Paris', 'Tokyo', 'Dubai', 'Delhi', 'New York', 'Bangkok', 'Malasiya', 'Melbourne', 'Moscow', 'Jerusalem', 'Madrid', 'Rome', 'Amsterdam', 'Riyadh', 'Singapore', 'AbuDhabi', 'Wellington', 'Budapest']
+AIRLINES = ['CloudSky', 'Global Airways', 'AirNova', 'AirIndia']
+START_DATE = datetime(2025, 12, 1, 0, 0, 0)
+# Bulk loads run with the journal in memory and without fsyncs; the app
+# sets each file's own journal mode (db.JOURNAL_MODE) on first connect.
+LOAD_PRAGMAS = ("PRAGMA journal_mode=MEMORY", "PRAGMA synchronous=OFF", "PRAGMA cache_size=-64000")
+
+def connect_for_load(path):
+    conn = sqlite3.connect(path)
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def insert_batches(c, sql, rows, batch_size=BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        c.executemany(sql, batch)
+
+def ring_schedule(total_flights, start_date=START_DATE):
+    # The original demo schedule: one flight a day around a ring of cities.
+    # Past a year it wraps onto the same days at later departure times.
+    for i in range(total_flights):
+        origin = CITIES[i % len(CITIES)]
+        destination = CITIES[(i + 1) % len(CITIES)]
+        departure = start_date + timedelta(days=i % BOOKING_WINDOW_DAYS, minutes=(i // BOOKING_WINDOW_DAYS) * 7 % 1440)
+        arrival = departure + timedelta(hours=8)
+        yield f"CS{1000 + i}", origin, destination, departure, arrival, 150 + (i % 100), AIRLINES[i % len(AIRLINES)]
+
+def random_schedule(total_flights, rng, start_date=START_DATE):
+    slots = BOOKING_WINDOW_DAYS * 24 * 12
+    for i in range(total_flights):
+        origin, destination = rng.sample(CITIES, 2)
+        departure = start_date + timedelta(minutes=5 * rng.randrange(slots))
+        arrival = departure + timedelta(minutes=rng.randrange(60, 16 * 60, 5))
+        yield f"CS{1000 + i}", origin, destination, departure, arrival, rng.randrange(80, 900), rng.choice(AIRLINES)
+
+def initialize_flights_db(total_flights=365, schedule=None, batch_size=BATCH_SIZE, info_path=FLIGHT_INFO_PATH):
+    conn = connect_for_load(DB_PATH)
     c = conn.cursor()
 
+    c.execute("DROP TABLE IF EXISTS seat_inventory")
+    c.execute("DROP TABLE IF EXISTS stats")
     c.execute("DROP TABLE IF EXISTS bookings")
     c.execute("DROP TABLE IF EXISTS flights")
+    # Fresh tables: every migration applies again in finalize_databases().
+    c.execute("PRAGMA user_version = 0")
 
     c.execute('''CREATE TABLE flights (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -37,45 +90,44 @@ def initialize_flights_db():
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY(flight_id) REFERENCES flights(id) ON DELETE CASCADE)''')
 
-    cities = ['Bangalore', 'London', 'Paris', 'Tokyo', 'Dubai', 'Delhi', 'New York', 'Bangkok', 'Malasiya', 'Melbourne', 'Moscow', 'Jerusalem', 'Madrid', 'Rome', 'Amsterdam', 'Riyadh', 'Singapore', 'AbuDhabi', 'Wellington', 'Budapest']
-    airlines = ['CloudSky', 'Global Airways', 'AirNova', 'AirIndia']
+    # Also created by migration main 7; the bulk load fills it first.
+    c.execute('''CREATE TABLE seat_inventory (
+        flight_id INTEGER PRIMARY KEY,
+        occupied INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY(flight_id) REFERENCES flights(id) ON DELETE CASCADE)''')
 
-    start_date = datetime(2025,12,1,0,0,0)
-    total_flights = 365
-    flight_log = []
+    if schedule is None:
+        schedule = ring_schedule(total_flights)
 
-    for i in range(total_flights):
-        origin = cities[i % len(cities)]
-        destination = cities[(i + 1) % len(cities)]
-        departure = start_date + timedelta(days=i)
-        arrival = departure + timedelta(hours=8)
-        flight_no = f"CS{1000 + i}"
-        price = 150 + (i % 100)
-        seats = 100
-        airline = airlines[i % len(airlines)]
+    # The info file is written line by line alongside the inserts, so memory
+    # stays flat however many flights are generated.
+    with open(info_path, "w") as f:
+        def rows():
+            for n, (flight_no, origin, destination, departure, arrival, price, airline) in enumerate(schedule):
+                if n:
+                    f.write("\n")
+                f.write(f"{flight_no} | {origin} -> {destination} | Departure: {departure.strftime('%d-%m-%Y %H:%M')} | Arrival: {arrival.strftime('%d-%m-%Y %H:%M')} | Price: ${price} | Airline: {airline}")
+                yield (flight_no, origin, destination,
+                       departure.strftime('%Y-%m-%d %H:%M:%S'),
+                       arrival.strftime('%Y-%m-%d %H:%M:%S'),
+                       price, SEATS_PER_FLIGHT, airline)
 
-        c.execute('''INSERT INTO flights 
+        insert_batches(c, '''INSERT INTO flights
             (flight_no, origin, destination, departure, arrival, price, seats, airline)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-            (flight_no, origin, destination,
-            departure.strftime('%Y-%m-%d %H:%M:%S'),
-            arrival.strftime('%Y-%m-%d %H:%M:%S'),
-            price, seats, airline))
-
-        flight_log.append(f"{flight_no} | {origin} -> {destination} | Departure: {departure.strftime('%d-%m-%Y %H:%M')} | Arrival: {arrival.strftime('%d-%m-%Y %H:%M')} | Price: ${price} | Airline: {airline}")
-
-    with open(FLIGHT_INFO_PATH, "w") as f:
-        f.write("\n".join(flight_log))
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows(), batch_size)
 
     conn.commit()
     conn.close()
 
 def initialize_admin_db():
-    conn = sqlite3.connect(ADMIN_DB)
+    conn = connect_for_load(ADMIN_DB)
     c = conn.cursor()
 
+    c.execute("DROP TABLE IF EXISTS stats")
     c.execute("DROP TABLE IF EXISTS admin_logs")
     c.execute("DROP TABLE IF EXISTS payments")
+    # Fresh tables: every migration applies again in finalize_databases().
+    c.execute("PRAGMA user_version = 0")
 
     c.execute('''CREATE TABLE payments (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -93,7 +145,7 @@ def initialize_admin_db():
         ip_address TEXT,
         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
 
-    c.execute('''INSERT INTO admin_logs 
+    c.execute('''INSERT INTO admin_logs
         (admin_username, action, ip_address)
         VALUES (?, ?, ?)''',
         ('system', 'Database initialized', '127.0.0.1'))
@@ -101,11 +153,14 @@ def initialize_admin_db():
     conn.commit()
     conn.close()
 
-def initialize_users_db():
-    conn = sqlite3.connect(USERS_DB)
+def initialize_users_db(extra_users=0, batch_size=BATCH_SIZE):
+    conn = connect_for_load(USERS_DB)
     c = conn.cursor()
 
+    c.execute("DROP TABLE IF EXISTS stats")
     c.execute("DROP TABLE IF EXISTS users")
+    # Fresh tables: every migration applies again in finalize_databases().
+    c.execute("PRAGMA user_version = 0")
 
     c.execute('''CREATE TABLE users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -118,24 +173,118 @@ def initialize_users_db():
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
 
     # Sample user
-    c.execute('''INSERT OR IGNORE INTO users 
+    sample_hash = generate_password_hash('Travel@123')
+    c.execute('''INSERT OR IGNORE INTO users
         (username, password_hash, full_name, email, phone, passport)
         VALUES (?, ?, ?, ?, ?, ?)''',
         ('john_doe',
-         generate_password_hash('Travel@123'),
+         sample_hash,
          'John Doe',
          'john.doe@example.com',
          '+1 (555) 123-4567',
          'P12345678'))
 
+    # Load-test users all share the sample password, so only one hash is
+    # ever computed.
+    insert_batches(c, '''INSERT INTO users
+        (username, password_hash, full_name, email, phone, passport)
+        VALUES (?, ?, ?, ?, ?, ?)''',
+        ((f'loadtest_{n}', sample_hash, f'Load Test {n}', f'loadtest_{n}@example.com',
+          f'+1 (555) {n % 10000:04d}', f'{n:08d}') for n in range(1, extra_users + 1)),
+        batch_size)
+
+    conn.commit()
+    conn.close()
+
+def generate_bookings(total_bookings, rng, batch_size=BATCH_SIZE, start_date=START_DATE):
+    conn = connect_for_load(DB_PATH)
+    admin_conn = connect_for_load(ADMIN_DB)
+    prices = array('d', (row[0] for row in conn.execute("SELECT price FROM flights ORDER BY id")))
+    flight_count = len(prices)
+    users_conn = sqlite3.connect(USERS_DB)
+    user_count, = users_conn.execute("SELECT COUNT(*) FROM users").fetchone()
+    users_conn.close()
+    seats_per_map = SEAT_ROWS * SEAT_COLS
+    total_bookings = min(total_bookings, flight_count * seats_per_map)
+    # Seat occupancy is tracked in memory as the same bitmap the app keeps in
+    # seat_inventory, so generated bookings never collide on a seat.
+    bitmaps = {}
+    payments = []
+
+    def bookings():
+        made = 0
+        while made < total_bookings:
+            flight_id = rng.randrange(1, flight_count + 1)
+            bitmap = bitmaps.get(flight_id, 0)
+            if bitmap == (1 << seats_per_map) - 1:
+                continue
+            bit = rng.choice([b for b in range(seats_per_map) if not bitmap & (1 << b)])
+            bitmaps[flight_id] = bitmap | (1 << bit)
+            made += 1
+            booking_ref = f"BKGEN{made:010d}"
+            amount = prices[flight_id - 1]
+            booked_at = (start_date - timedelta(minutes=rng.randrange(BOOKING_WINDOW_DAYS * 1440))).strftime('%Y-%m-%d %H:%M:%S')
+            payments.append((booking_ref, amount, f"{rng.randrange(10000):04d}", booked_at))
+            yield flight_id, rng.randrange(1, user_count + 1), booking_ref, amount, seat_label(bit), booked_at
+
+    def flush_payments(rows):
+        for row in rows:
+            yield row
+            if len(payments) >= batch_size:
+                admin_conn.executemany('''INSERT INTO payments (booking_ref, amount, card_last4, payment_date)
+                                          VALUES (?, ?, ?, ?)''', payments)
+                payments.clear()
+
+    insert_batches(conn, '''INSERT INTO bookings
+        (flight_id, user_id, booking_ref, payment_amount, seat_number, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)''', flush_payments(bookings()), batch_size)
+    admin_conn.executemany('''INSERT INTO payments (booking_ref, amount, card_last4, payment_date)
+                              VALUES (?, ?, ?, ?)''', payments)
+    insert_batches(conn, 'INSERT INTO seat_inventory (flight_id, occupied) VALUES (?, ?)', bitmaps.items(), batch_size)
+    insert_batches(conn, 'UPDATE flights SET seats = seats - ? WHERE id = ?',
+                   ((bin(bitmap).count('1'), flight_id) for flight_id, bitmap in bitmaps.items()), batch_size)
     conn.commit()
+    admin_conn.commit()
     conn.close()
+    admin_conn.close()
+
+def finalize_databases():
+    # Indexes and the counter/catalog triggers are added after the bulk
+    # load: building an index once is far cheaper than maintaining it per
+    # row, and the stats tables seed themselves from the loaded rows.
+    migrations.migrate({'main': DB_PATH, 'admin': ADMIN_DB, 'users': USERS_DB})
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("UPDATE catalog_meta SET version = version + 1 WHERE id = 1")
+    conn.commit()
+    conn.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Create flights.db, admin.db and users.db, optionally at load-test scale.")
+    parser.add_argument('--flights', type=int, default=365, help="number of flights to generate")
+    parser.add_argument('--users', type=int, default=0, help="extra load-test users on top of the sample user")
+    parser.add_argument('--bookings', type=int, default=0, help="bookings (with matching payments) to generate")
+    parser.add_argument('--schedule', choices=['ring', 'random'], default='ring',
+                        help="ring: the demo one-flight-a-day ring; random: random routes and times")
+    parser.add_argument('--start-date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'), default=START_DATE,
+                        help="first departure day, YYYY-MM-DD")
+    parser.add_argument('--seed', type=int, default=0, help="seed for every random choice, for reproducible datasets")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    return parser.parse_args(argv)
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    if args.schedule == 'random':
+        schedule = random_schedule(args.flights, rng, args.start_date)
+    else:
+        schedule = ring_schedule(args.flights, args.start_date)
     print("Initializing databases...")
-    initialize_flights_db()
+    initialize_flights_db(args.flights, schedule, args.batch_size)
     initialize_admin_db()
-    initialize_users_db()
+    initialize_users_db(args.users, args.batch_size)
+    if args.bookings:
+        generate_bookings(args.bookings, rng, args.batch_size, args.start_date)
+    finalize_databases()
     print("""
     Databases created successfully!
     - flights.db: Contains flight and bookings info
@@ -0,0 +1,139 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from flask import g
+
+POOL_SIZE = 8
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT = 5.0
+# A booking commits its user, seats, booking and payment across three
+# attached files, and SQLite only makes such a commit crash-atomic in a
+# rollback-journal mode (a super-journal ties the files together); in WAL a
+# crash can leave a booking without its payment. So the default is DELETE,
+# with full syncs. SQLITE_JOURNAL_MODE=WAL lets readers run alongside the
+# writer, at the cost of that guarantee.
+JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'DELETE')
+SCHEMA_PRAGMAS = (
+    "journal_mode={}".format(JOURNAL_MODE),
+    "synchronous={}".format('NORMAL' if JOURNAL_MODE.upper() == 'WAL' else 'FULL'),
+    "cache_size=-16000",
+    "mmap_size=134217728",
+)
+PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE, attach=None, migrate=None):
+        self.path = path
+        self.size = size
+        self.attach = dict(attach or {})
+        self.migrate = migrate
+        # Optional callable handed every statement new connections run
+        # (sqlite3 set_trace_callback); used by the query-plan check.
+        self.trace = None
+        self._migrated = migrate is None
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        # check_same_thread is off because a connection may be released on a
+        # different worker thread than the one that opened it; the pool
+        # guarantees a connection is only ever used by one request at a time.
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        if self.trace is not None:
+            conn.set_trace_callback(self.trace)
+        if not self._migrated:
+            # Every table, column, index and trigger the app relies on
+            # beyond the files' original layout comes from these migrations.
+            self.migrate({'main': self.path, **self.attach})
+            self._migrated = True
+        for name, path in self.attach.items():
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+        for name in ('main', *self.attach):
+            for pragma in SCHEMA_PRAGMAS:
+                conn.execute(f"PRAGMA {name}.{pragma}")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path, attach=None, migrate=None):
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(path, ConnectionPool(path, attach=attach, migrate=migrate))
+    return pool
+
+
+def get_connection(path, attach=None, migrate=None):
+    # One warm connection per database per app context, handed back to the
+    # pool in teardown.
+    conns = g.setdefault('_db_connections', {})
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = get_pool(path, attach, migrate).acquire()
+    return conn
+
+
+@contextmanager
+def immediate_transaction(conn):
+    # BEGIN IMMEDIATE takes the write lock up front, so read-then-write
+    # sequences inside the block cannot interleave with another writer.
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def release_connections(exc=None):
+    conns = g.pop('_db_connections', None)
+    if not conns:
+        return
+    for path, conn in conns.items():
+        get_pool(path).release(conn)
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        _pools.clear()
+
+
+def init_app(app):
+    app.teardown_appcontext(release_connections)
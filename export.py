@@ -0,0 +1,137 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+BATCH_SIZE = 1000
+
+# (output column, SQL expression); bookings.id leads so any row can serve as
+# the resume point for the next request (?after=<booking_id>).
+COLUMNS = (
+    ('booking_id', 'b.id'),
+    ('booking_ref', 'b.booking_ref'),
+    ('group_ref', 'b.group_ref'),
+    ('passenger_name', 'b.passenger_name'),
+    ('booked_at', 'b.created_at'),
+    ('booking_status', 'b.status'),
+    ('seat_number', 'b.seat_number'),
+    ('flight_no', 'f.flight_no'),
+    ('origin', 'f.origin'),
+    ('destination', 'f.destination'),
+    ('departure', 'f.departure'),
+    ('user_id', 'u.id'),
+    ('username', 'u.username'),
+    ('full_name', 'u.full_name'),
+    ('email', 'u.email'),
+    ('amount', 'p.amount'),
+    ('card_last4', 'p.card_last4'),
+    ('payment_method', 'p.payment_method'),
+    ('payment_status', 'p.status'),
+    ('payment_date', 'p.payment_date'),
+)
+FIELDNAMES = [name for name, _ in COLUMNS]
+
+
+def parse_filters(args):
+    # start/end are booking dates (YYYY-MM-DD), both inclusive.
+    start = end = None
+    if args.get('start'):
+        start = datetime.strptime(args['start'], '%Y-%m-%d').strftime('%Y-%m-%d')
+    if args.get('end'):
+        end = (datetime.strptime(args['end'], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    after = int(args.get('after', 0))
+    if after < 0:
+        raise ValueError(after)
+    return start, end, after
+
+
+def resume_point(conn, after):
+    # The (created_at, id) position of the booking an export resumes after.
+    # A booking that no longer exists has no position; carrying on from
+    # nowhere would return nothing and look like a finished export.
+    row = conn.execute('SELECT created_at, id FROM bookings WHERE id = ?', (after,)).fetchone()
+    if row is None:
+        raise LookupError(after)
+    return tuple(row)
+
+
+def export_query(start=None, end=None, after=None):
+    # Rows come in booking order on idx_bookings_created, so a date range is
+    # an index range rather than a walk of every booking. `after` is a
+    # resume_point() and starts from that booking's place in the same order.
+    clauses, params = [], []
+    if after:
+        clauses.append('(b.created_at, b.id) > (?, ?)')
+        params += list(after)
+    if start:
+        clauses.append('b.created_at >= ?')
+        params.append(start)
+    if end:
+        clauses.append('b.created_at < ?')
+        params.append(end)
+    sql = f'''
+        SELECT {', '.join(expr for _, expr in COLUMNS)}
+        FROM bookings b
+        JOIN flights f ON f.id = b.flight_id
+        LEFT JOIN users u ON u.id = b.user_id
+        LEFT JOIN payments p ON p.booking_ref = b.booking_ref
+        {'WHERE ' + ' AND '.join(clauses) if clauses else ''}
+        ORDER BY b.created_at, b.id
+    '''
+    return sql, params
+
+
+def iter_batches(pool, start=None, end=None, after=None, batch_size=BATCH_SIZE):
+    # One statement stepped batch by batch: rows are read as the client
+    # consumes them, so memory holds a single batch at a time and the whole
+    # export sees one consistent snapshot. The connection is borrowed from
+    # the pool for the life of the stream and returned when the generator
+    # finishes or the client disconnects.
+    conn = pool.acquire()
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    try:
+        cursor.execute(*export_query(start, end, after))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+        pool.release(conn)
+
+
+# A spreadsheet runs a cell starting with one of these as a formula. Names,
+# emails and the like are typed by customers, so such cells are written
+# with a leading quote, which makes them plain text.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDNAMES)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([csv_cell(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+
+
+def stream_ndjson(batches):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(FIELDNAMES, row))) + '\n' for row in rows)
+
+
+FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+}
@@ -0,0 +1,39 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import request
+from werkzeug.http import is_resource_modified
+
+
+def templates_digest(folder):
+    # Part of every ETag, so a deploy that changes a template never gets
+    # answered with a 304 for the old page. Every worker computes the same
+    # value from the same files.
+    digest = hashlib.sha1()
+    for root, _, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(name.encode() + b'\0' + f.read())
+    return digest.hexdigest()[:12]
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def http_date(timestamp):
+    return datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+
+
+def not_modified(etag, last_modified):
+    return not is_resource_modified(request.environ, etag=etag, last_modified=http_date(last_modified))
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = http_date(last_modified)
+    # Revalidate every time; the check is cheap and answers 304.
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Cookie')
+    return response
@@ -0,0 +1,206 @@
+import heapq
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime
+
+MAX_LEGS = 3
+MIN_CONNECTION_MINUTES = 60
+MAX_TRIP_HOURS = 72
+RESULT_LIMIT = 10
+# At most this many departures per route are expanded from any one city;
+# later ones are only kept if they arrive earlier or cost less than every
+# departure already taken.
+MAX_DEPARTURES_PER_ROUTE = 4
+SORT_KEYS = ('arrival', 'price')
+
+Itinerary = namedtuple('Itinerary', 'legs departure arrival price stops')
+
+_EPOCH = datetime(2000, 1, 1)
+
+
+def to_minutes(timestamp):
+    return int((datetime.fromisoformat(timestamp) - _EPOCH).total_seconds()) // 60
+
+
+class RouteNetwork:
+    # Time-expanded view of a catalog snapshot: for every city, the routes
+    # leaving it, each with its departures sorted by time so the next
+    # connection after a given minute is one bisect away.
+    def __init__(self, snapshot):
+        self.version = snapshot.version
+        routes = {}
+        for flight in snapshot.flights.values():
+            origin = flight.origin.strip().lower()
+            destination = flight.destination.strip().lower()
+            dep, arr = to_minutes(flight.departure), to_minutes(flight.arrival)
+            routes.setdefault(origin, {}).setdefault(destination, []).append((dep, arr, flight.price, flight))
+        self.routes = {}
+        # Cheapest fare and shortest flight time ever seen on each route,
+        # used as lower bounds to steer the search toward the destination.
+        self.route_bounds = {}
+        for origin, by_destination in routes.items():
+            self.routes[origin] = {}
+            for destination, legs in by_destination.items():
+                legs.sort(key=lambda leg: (leg[0], leg[3].id))
+                self.routes[origin][destination] = ([leg[0] for leg in legs], legs)
+                self.route_bounds[origin, destination] = (
+                    min(leg[2] for leg in legs), min(leg[1] - leg[0] for leg in legs))
+        self._bounds = {}
+
+    def _lower_bounds(self, destination):
+        # Dijkstra backwards from the destination over the static route
+        # graph: the least any remaining journey from a city can cost and
+        # take. Both are admissible, so ranking by value-so-far plus bound
+        # still pops complete itineraries in true ranking order.
+        bounds = self._bounds.get(destination)
+        if bounds is not None:
+            return bounds
+        reverse = {}
+        for (origin, dest), bound in self.route_bounds.items():
+            reverse.setdefault(dest, []).append((origin, bound))
+        bounds = []
+        for index in (0, 1):
+            best = {destination: 0}
+            heap = [(0, destination)]
+            while heap:
+                value, city = heapq.heappop(heap)
+                if value > best[city]:
+                    continue
+                for origin, bound in reverse.get(city, ()):
+                    candidate = value + bound[index]
+                    if candidate < best.get(origin, float('inf')):
+                        best[origin] = candidate
+                        heapq.heappush(heap, (candidate, origin))
+            bounds.append(best)
+        self._bounds[destination] = bounds
+        return bounds
+
+    def _departures(self, city, destinations, earliest, latest, horizon, passengers):
+        found = []
+        routes = self.routes[city]
+        for destination in destinations:
+            times, legs = routes[destination]
+            best_arrival = best_price = float('inf')
+            taken = 0
+            for i in range(bisect_left(times, earliest), len(times)):
+                leg = legs[i]
+                if leg[0] > latest:
+                    break
+                arr, price = leg[1], leg[2]
+                if arr > horizon or (arr >= best_arrival and price >= best_price) or leg[3].seats < passengers:
+                    continue
+                if arr < best_arrival:
+                    best_arrival = arr
+                if price < best_price:
+                    best_price = price
+                found.append((destination, leg))
+                taken += 1
+                if taken == MAX_DEPARTURES_PER_ROUTE:
+                    break
+        return found
+
+    def search(self, origin, destination, date_str, passengers=1, sort='arrival',
+               max_legs=MAX_LEGS, min_connection=MIN_CONNECTION_MINUTES, limit=RESULT_LIMIT, direct=True):
+        # Best-first (A*) search over partial itineraries. A partial
+        # itinerary is dropped once `limit` others reached the same city no
+        # later, no dearer and in no more legs.
+        origin = origin.strip().lower()
+        destination = destination.strip().lower()
+        if origin == destination or origin not in self.routes:
+            return []
+        price_bound, time_bound = self._lower_bounds(destination)
+        if origin not in price_bound:
+            return []
+        day_start = to_minutes(date_str)
+        horizon = day_start + MAX_TRIP_HOURS * 60
+        by_price = sort == 'price'
+        heap = []
+        counter = 0
+
+        def push(city, legs, price):
+            nonlocal counter
+            arrival = legs[-1][1]
+            if city not in price_bound or arrival + time_bound[city] > horizon:
+                return
+            if by_price:
+                key = (price + price_bound[city], arrival + time_bound[city])
+            else:
+                key = (arrival + time_bound[city], price + price_bound[city])
+            counter += 1
+            heapq.heappush(heap, (key, counter, city, legs, price))
+
+        for city, leg in self._departures(origin, self.routes[origin], day_start, day_start + 1439,
+                                          horizon, passengers):
+            if direct or city != destination:
+                push(city, (leg,), leg[2])
+
+        settled = {}
+        results = []
+        while heap and len(results) < limit:
+            _, _, city, legs, price = heapq.heappop(heap)
+            if city == destination:
+                results.append(Itinerary([leg[3] for leg in legs], legs[0][3].departure,
+                                         legs[-1][3].arrival, price, len(legs) - 1))
+                continue
+            if len(legs) >= max_legs or city not in self.routes:
+                continue
+            arrival = legs[-1][1]
+            labels = settled.setdefault(city, [])
+            dominated = sum(1 for a, p, n in labels if a <= arrival and p <= price and n <= len(legs))
+            if dominated >= limit:
+                continue
+            labels.append((arrival, price, len(legs)))
+            if len(legs) + 1 == max_legs:
+                # Only the route into the destination can finish in time.
+                destinations = (destination,) if destination in self.routes[city] else ()
+            else:
+                visited = {origin} | {leg[3].destination.strip().lower() for leg in legs}
+                destinations = [d for d in self.routes[city] if d not in visited]
+            for next_city, leg in self._departures(city, destinations, arrival + min_connection,
+                                                   horizon, horizon, passengers):
+                push(next_city, legs + (leg,), price + leg[2])
+        return results
+
+
+_lock = threading.Lock()
+# Catalog path -> the network built from its latest snapshot so far.
+_latest = {}
+
+
+def get_network(catalog):
+    # Built on first use and kept on the snapshot itself, so it is rebuilt
+    # exactly when the catalog is. Only one thread builds; the others keep
+    # searching the previous network rather than queueing behind the build,
+    # the same as FlightCatalog.snapshot().
+    snapshot = catalog.snapshot()
+    network = getattr(snapshot, 'network', None)
+    if network is not None:
+        return network
+    previous = _latest.get(catalog.path)
+    if not _lock.acquire(blocking=previous is None):
+        return previous
+    try:
+        network = getattr(snapshot, 'network', None)
+        if network is None:
+            network = snapshot.network = _latest[catalog.path] = RouteNetwork(snapshot)
+        return network
+    finally:
+        _lock.release()
+
+
+def with_live_seats(conn, itineraries, passengers=1):
+    # The snapshot's seat counts are as of its last rebuild, so the search
+    # only uses them to prune; this drops itineraries with a leg that has
+    # since sold out.
+    ids = {flight.id for itinerary in itineraries for flight in itinerary.legs}
+    if not ids:
+        return []
+    placeholders = ','.join('?' * len(ids))
+    seats = dict(conn.execute(f'SELECT id, seats FROM flights WHERE id IN ({placeholders})', list(ids)).fetchall())
+    available = []
+    for itinerary in itineraries:
+        legs = [flight._replace(seats=seats.get(flight.id, 0)) for flight in itinerary.legs]
+        if all(flight.seats >= passengers for flight in legs):
+            available.append(itinerary._replace(legs=legs))
+    return available
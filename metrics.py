@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter as _Tally
+
+from flask import Response, g, has_request_context, request, template_rendered, before_render_template
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+# The same statement this many times in one request is reported as N+1.
+N_PLUS_ONE_THRESHOLD = 5
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0)) or None
+
+slow_log = logging.getLogger('cloudsky.slow_requests')
+if os.environ.get('SLOW_REQUEST_LOG'):
+    slow_log.addHandler(logging.FileHandler(os.environ['SLOW_REQUEST_LOG']))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels, value):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint', 'method'))
+REQUESTS = Counter('http_requests_total', 'Requests by endpoint and status.', ('endpoint', 'method', 'status'))
+SQL_QUERIES = Histogram('sql_queries_per_request', 'SQL statements executed per request.', ('endpoint',),
+                        buckets=QUERY_COUNT_BUCKETS)
+SQL_DURATION = Histogram('sql_query_duration_seconds', 'Time per SQL statement, including row fetches.', ('endpoint',))
+SQL_TIME = Histogram('sql_time_per_request_seconds', 'Total SQL time per request.', ('endpoint',))
+N_PLUS_ONE = Counter('sql_n_plus_one_total', 'Requests that repeated one statement N+1 style.', ('endpoint',))
+TEMPLATE_DURATION = Histogram('template_render_duration_seconds', 'Template render time.', ('template',))
+TICKET_DURATION = Histogram('ticket_render_duration_seconds', 'Ticket PDF render time.', ('mode',))
+SLOW_REQUESTS = Counter('slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.', ('endpoint',))
+REGISTRY = [REQUEST_DURATION, REQUESTS, SQL_QUERIES, SQL_DURATION, SQL_TIME, N_PLUS_ONE,
+            TEMPLATE_DURATION, TICKET_DURATION, SLOW_REQUESTS]
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._record[1] += time.perf_counter() - started
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def __iter__(self):
+        while True:
+            row = self._timed(self._cursor.fetchone)
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    # Wraps a pooled connection for one request and records every statement
+    # (text and time, including row fetches) on flask.g.
+    def __init__(self, conn):
+        self._conn = conn
+
+    def _run(self, method, sql, *args):
+        started = time.perf_counter()
+        cursor = method(sql, *args)
+        record = [sql, time.perf_counter() - started]
+        if has_request_context() and g.get('_queries') is not None:
+            g._queries.append(record)
+        return InstrumentedCursor(cursor, record)
+
+    def execute(self, sql, *args):
+        return self._run(self._conn.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._run(self._conn.executemany, sql, *args)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrument(conn):
+    return InstrumentedConnection(conn)
+
+
+def _before_request():
+    g._request_started = time.perf_counter()
+    g._queries = []
+
+
+def _after_request(response):
+    started = g.pop('_request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = _endpoint()
+    queries = g.pop('_queries', [])
+    REQUEST_DURATION.observe(endpoint, request.method, value=elapsed)
+    REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    SQL_QUERIES.observe(endpoint, value=len(queries))
+    SQL_TIME.observe(endpoint, value=sum(q[1] for q in queries))
+    for _, query_time in queries:
+        SQL_DURATION.observe(endpoint, value=query_time)
+    repeated = [(sql, n) for sql, n in _Tally(q[0] for q in queries).items() if n >= N_PLUS_ONE_THRESHOLD]
+    if repeated:
+        N_PLUS_ONE.inc(endpoint)
+    if SLOW_REQUEST_MS is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+        SLOW_REQUESTS.inc(endpoint)
+        slow_log.warning(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 3),
+            'sql_ms': round(sum(q[1] for q in queries) * 1000, 3),
+            'templates_ms': round(g.pop('_template_time', 0.0) * 1000, 3),
+            'queries': [{'sql': ' '.join(sql.split()), 'ms': round(t * 1000, 3)} for sql, t in queries],
+            'n_plus_one': [{'sql': ' '.join(sql.split()), 'count': n} for sql, n in repeated],
+        }))
+    return response
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('_template_starts', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    starts = g.get('_template_starts')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    g._template_time = g.get('_template_time', 0.0) + elapsed
+    TEMPLATE_DURATION.observe(template.name or 'string', value=elapsed)
+
+
+def observe_ticket(mode, seconds):
+    TICKET_DURATION.observe(mode, value=seconds)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,327 @@
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+
+from scratch import scratch_app
+
+BUSY_TIMEOUT = 30.0
+
+# Keyed by schema name as the app attaches the files ('main' is flights.db).
+# Each file records the last migration it has applied in PRAGMA user_version.
+# Migrations only ever add: columns, indexes, tables. Never drop or rewrite.
+MIGRATIONS = {
+    'main': (
+        (1, "index bookings by user and by flight/seat; keyset index on departures", (
+            "CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings (user_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_bookings_flight_seat ON bookings (flight_id, seat_number)",
+            "CREATE INDEX IF NOT EXISTS idx_flights_departure ON flights (departure, id)",
+        )),
+        # Virtual generated columns: computed on read, so adding them is a
+        # schema change only, and indexing them is what makes
+        # 'route = ? AND departure_date = ?' an index search.
+        (2, "normalized route and departure date columns on flights", (
+            "ALTER TABLE flights ADD COLUMN route TEXT GENERATED ALWAYS AS "
+            "(lower(trim(origin)) || '|' || lower(trim(destination))) VIRTUAL",
+            "ALTER TABLE flights ADD COLUMN departure_date TEXT GENERATED ALWAYS AS "
+            "(substr(departure, 1, 10)) VIRTUAL",
+            "CREATE INDEX IF NOT EXISTS idx_flights_route_date ON flights (route, departure_date, departure, id)",
+        )),
+        # One row per passenger as before; seats booked together share a
+        # group_ref and a combined ticket.
+        (3, "group bookings: passenger name and group reference on bookings", (
+            "ALTER TABLE bookings ADD COLUMN passenger_name TEXT",
+            "ALTER TABLE bookings ADD COLUMN group_ref TEXT",
+            "CREATE INDEX IF NOT EXISTS idx_bookings_group ON bookings (group_ref)",
+        )),
+        # The admin export filters on booking date; without this it reads
+        # every booking to find one day's worth.
+        (4, "index bookings by creation date", (
+            "CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings (created_at, id)",
+        )),
+        # The city filter on /api/flights: one equality range per city and
+        # side, already in (departure, id) order.
+        (5, "normalized origin and destination columns on flights", (
+            "ALTER TABLE flights ADD COLUMN origin_key TEXT GENERATED ALWAYS AS (lower(trim(origin))) VIRTUAL",
+            "ALTER TABLE flights ADD COLUMN destination_key TEXT GENERATED ALWAYS AS "
+            "(lower(trim(destination))) VIRTUAL",
+            "CREATE INDEX IF NOT EXISTS idx_flights_origin ON flights (origin_key, departure, id)",
+            "CREATE INDEX IF NOT EXISTS idx_flights_destination ON flights (destination_key, departure, id)",
+        )),
+        # Dashboard counters (stats.py). Each file keeps its own stats table,
+        # kept current by triggers on that file's tables: SQLite triggers
+        # cannot write across attached files. Seeded from the live tables
+        # once, here, rather than re-aggregated on every connect.
+        (6, "dashboard counters for flights and bookings", (
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value NUMERIC NOT NULL DEFAULT 0)",
+            "INSERT OR IGNORE INTO stats (name, value) SELECT 'flights', COUNT(*) FROM flights",
+            "INSERT OR IGNORE INTO stats (name, value) SELECT 'bookings', COUNT(*) FROM bookings",
+            "CREATE TRIGGER IF NOT EXISTS stats_flights_insert AFTER INSERT ON flights "
+            "BEGIN UPDATE stats SET value = value + 1 WHERE name = 'flights'; END",
+            "CREATE TRIGGER IF NOT EXISTS stats_flights_delete AFTER DELETE ON flights "
+            "BEGIN UPDATE stats SET value = value - 1 WHERE name = 'flights'; END",
+            "CREATE TRIGGER IF NOT EXISTS stats_bookings_insert AFTER INSERT ON bookings "
+            "BEGIN UPDATE stats SET value = value + 1 WHERE name = 'bookings'; END",
+            "CREATE TRIGGER IF NOT EXISTS stats_bookings_delete AFTER DELETE ON bookings "
+            "BEGIN UPDATE stats SET value = value - 1 WHERE name = 'bookings'; END",
+        )),
+        # One bitmap of occupied seats per flight (seats.py); booking a seat
+        # is a compare-and-set on it.
+        (7, "seat inventory bitmaps", (
+            "CREATE TABLE IF NOT EXISTS seat_inventory ("
+            "flight_id INTEGER PRIMARY KEY, "
+            "occupied INTEGER NOT NULL DEFAULT 0, "
+            "FOREIGN KEY(flight_id) REFERENCES flights(id) ON DELETE CASCADE)",
+        )),
+        # catalog_meta.version moves whenever a flight's schedule or fare
+        # changes, but not when only the seat count does, so bookings don't
+        # force a catalog rebuild. Seat changes instead stamp the flight in
+        # flight_versions with the next value of one global sequence, which
+        # is what per-flight caches key on.
+        (8, "catalog version and per-flight seat sequence", (
+            "CREATE TABLE IF NOT EXISTS catalog_meta (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)",
+            "INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0)",
+            "CREATE TRIGGER IF NOT EXISTS flights_catalog_insert AFTER INSERT ON flights "
+            "BEGIN UPDATE catalog_meta SET version = version + 1 WHERE id = 1; END",
+            "CREATE TRIGGER IF NOT EXISTS flights_catalog_delete AFTER DELETE ON flights "
+            "BEGIN UPDATE catalog_meta SET version = version + 1 WHERE id = 1; END",
+            "CREATE TRIGGER IF NOT EXISTS flights_catalog_update "
+            "AFTER UPDATE OF flight_no, origin, destination, departure, arrival, price, airline ON flights "
+            "BEGIN UPDATE catalog_meta SET version = version + 1 WHERE id = 1; END",
+            "CREATE TABLE IF NOT EXISTS flight_versions (flight_id INTEGER PRIMARY KEY, seq INTEGER NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS idx_flight_versions_seq ON flight_versions (seq)",
+            "CREATE TRIGGER IF NOT EXISTS flight_versions_seats AFTER UPDATE OF seats ON flights "
+            "BEGIN INSERT OR REPLACE INTO flight_versions (flight_id, seq) "
+            "VALUES (NEW.id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM flight_versions)); END",
+        )),
+    ),
+    'admin': (
+        (1, "index payments by date for the dashboard", (
+            "CREATE INDEX IF NOT EXISTS idx_payments_date ON payments (payment_date)",
+        )),
+        (2, "dashboard revenue counter", (
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value NUMERIC NOT NULL DEFAULT 0)",
+            "INSERT OR IGNORE INTO stats (name, value) SELECT 'revenue', COALESCE(SUM(amount), 0) FROM payments",
+            "CREATE TRIGGER IF NOT EXISTS stats_payments_insert AFTER INSERT ON payments "
+            "BEGIN UPDATE stats SET value = value + NEW.amount WHERE name = 'revenue'; END",
+            "CREATE TRIGGER IF NOT EXISTS stats_payments_delete AFTER DELETE ON payments "
+            "BEGIN UPDATE stats SET value = value - OLD.amount WHERE name = 'revenue'; END",
+            "CREATE TRIGGER IF NOT EXISTS stats_payments_update AFTER UPDATE OF amount ON payments "
+            "BEGIN UPDATE stats SET value = value + NEW.amount - OLD.amount WHERE name = 'revenue'; END",
+        )),
+    ),
+    'users': (
+        (1, "dashboard user counter", (
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value NUMERIC NOT NULL DEFAULT 0)",
+            "INSERT OR IGNORE INTO stats (name, value) SELECT 'users', COUNT(*) FROM users",
+            "CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users "
+            "BEGIN UPDATE stats SET value = value + 1 WHERE name = 'users'; END",
+            "CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users "
+            "BEGIN UPDATE stats SET value = value - 1 WHERE name = 'users'; END",
+        )),
+    ),
+}
+
+# Tables that hold a handful of rows by design; scanning them is fine.
+SMALL_TABLES = {'stats', 'catalog_meta'}
+# Statements (whitespace collapsed, parameters bound) allowed to walk a whole
+# index: unfiltered, ordered by that index and cut off by LIMIT, so they
+# stop after a page. Anything with a WHERE that the index can't answer is
+# not on this list, whatever its LIMIT.
+ORDERED_PAGES = (
+    re.compile(r"SELECT \* FROM flights ORDER BY departure, id LIMIT \d+"),
+    re.compile(r"SELECT \* FROM payments ORDER BY payment_date DESC LIMIT \d+"),
+)
+
+
+def route_value(origin, destination):
+    # Same expression as the generated flights.route column.
+    return f"{origin.strip().lower()}|{destination.strip().lower()}"
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(paths, log=None):
+    # paths: {'main': 'flights.db', 'admin': 'admin.db', 'users': 'users.db'}.
+    # Each migration runs in its own BEGIN IMMEDIATE transaction and
+    # re-reads user_version once it holds the lock, so several processes
+    # starting at once apply it exactly once.
+    applied = []
+    for name, path in paths.items():
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        try:
+            for version, description, statements in MIGRATIONS.get(name, ()):
+                if current_version(conn) >= version:
+                    continue
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if current_version(conn) >= version:
+                        conn.execute('ROLLBACK')
+                        continue
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f'PRAGMA user_version = {version}')
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                applied.append((name, version, description))
+                if log is not None:
+                    log(f"{path}: applied {version} ({description})")
+        finally:
+            conn.close()
+    return applied
+
+
+def pending(paths):
+    result = []
+    for name, path in paths.items():
+        conn = sqlite3.connect(path)
+        try:
+            version = current_version(conn)
+        finally:
+            conn.close()
+        result.extend((name, v, description) for v, description, _ in MIGRATIONS.get(name, ()) if v > version)
+    return result
+
+
+def table_scans(conn, sql):
+    # Plan lines that read a whole table or a whole index rather than
+    # searching one. 'SCAN t USING [COVERING] INDEX' still visits every row
+    # unless the statement is one of ORDERED_PAGES.
+    if any(page.fullmatch(' '.join(sql.split())) for page in ORDERED_PAGES):
+        return []
+    scans = []
+    for _, _, _, detail in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+        words = detail.split()
+        if words[0] != 'SCAN' or words[1] in ('CONSTANT', 'SUBQUERY'):
+            continue
+        if words[1].rsplit('.', 1)[-1] not in SMALL_TABLES:
+            scans.append(detail)
+    return scans
+
+
+def collect_queries(app_module):
+    # Drives every route with the test client and records each statement
+    # the app's pooled connections run, parameters bound.
+    import db
+    app = app_module.app
+    statements = []
+    pool = db.get_pool(app.config['DATABASE'],
+                       attach={'admin': app.config['ADMIN_DB'], 'users': app.config['USERS_DB']},
+                       migrate=migrate)
+    pool.trace = statements.append
+
+    conn = sqlite3.connect(app.config['DATABASE'])
+    tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    flight = conn.execute('SELECT id, origin, destination, departure FROM flights WHERE departure >= ? '
+                          'ORDER BY departure LIMIT 1', (tomorrow,)).fetchone()
+    conn.close()
+    flight_id, origin, destination, departure = flight
+    day = datetime.strptime(departure[:10], '%Y-%m-%d').strftime('%d-%m-%Y')
+
+    client = app.test_client()
+    client.get('/home')
+    page = client.get('/api/flights', query_string={'q': origin}).get_json()
+    client.get('/api/flights', query_string={'q': origin, 'cursor': page['next_cursor'] or ''})
+    client.get('/api/flights', query_string={'q': day})
+    client.get('/api/flights', query_string={'city': origin[:3], 'date': day})
+    client.get('/api/flights', query_string={'origin': origin, 'destination': destination, 'date': day})
+    client.get('/api/fares', query_string={'origin': origin, 'destination': destination, 'date': day})
+    client.post('/search', data={'origin': origin, 'destination': destination, 'date': day, 'passengers': '1'})
+    client.get(f'/book/{flight_id}')
+    response = client.post(f'/book/{flight_id}', data={
+        'full_name': 'Plan Check', 'email': 'plan-check@example.com', 'phone': '5550000',
+        'passport': '99999999', 'card_number': '4111111111111111', 'selected_seat': 'R4C6'})
+    match = re.search(r'BK\d{8}[0-9A-F]{8}', response.get_data(as_text=True))
+    client.get(re.search(r'/download_ticket/[^"]+', response.get_data(as_text=True)).group(0))
+    response = client.post(f'/book/{flight_id}', data={
+        'full_name': 'Plan Check', 'email': 'plan-check@example.com', 'phone': '5550000',
+        'passport': '99999999', 'card_number': '4111111111111111', 'selected_seat': 'R4C4,R4C5',
+        'passenger_name': 'Plan Check Two'})
+    client.get(re.search(r'/download_ticket/[^"]+', response.get_data(as_text=True)).group(0))
+    client.post('/register', data={'username': 'plan_check', 'full_name': 'Plan Check', 'email': 'plan@example.com',
+                                   'phone': '', 'passport': '88888888', 'password': 'pw', 'password2': 'pw'})
+    client.get('/home')
+    client.get('/logout')
+    client.post('/login', data={'email_or_username': 'plan_check', 'password': 'pw'})
+    client.post('/claim', data={'email': 'plan-check@example.com', 'booking_ref': match.group(0) if match else '',
+                                'password': 'pw', 'password2': 'pw'})
+    with client.session_transaction() as session:
+        session['admin'] = 'plan-check'
+    client.get('/admin/dashboard')
+    client.get('/download_ticket/1')
+    client.get('/admin/export.csv', query_string={'start': tomorrow, 'end': tomorrow, 'after': 0})
+    app_module.ticket_queue.shutdown()
+    return statements
+
+
+def check_query_plans():
+    # Builds a fresh dataset in a temporary directory, runs the app against
+    # it and returns {statement: [scan details]} for every statement whose
+    # plan reads a whole table.
+    cwd = os.getcwd()
+    workdir = None
+    try:
+        app_module, workdir = scratch_app(
+            'query-plans-', ['--flights', '2000', '--users', '50', '--bookings', '500', '--schedule', 'random',
+                             '--start-date', datetime.now().strftime('%Y-%m-%d')])
+        statements = collect_queries(app_module)
+
+        conn = sqlite3.connect('flights.db')
+        conn.execute("ATTACH DATABASE 'admin.db' AS admin")
+        conn.execute("ATTACH DATABASE 'users.db' AS users")
+        failures = {}
+        checked = 0
+        for sql in dict.fromkeys(' '.join(s.split()) for s in statements):
+            if sql.split(' ', 1)[0].upper() not in ('SELECT', 'UPDATE', 'DELETE', 'WITH'):
+                continue
+            checked += 1
+            scans = table_scans(conn, sql)
+            if scans:
+                failures[sql] = scans
+        conn.close()
+        return checked, failures
+    finally:
+        os.chdir(cwd)
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations, or check the app's query plans.")
+    parser.add_argument('--flights-db', default='flights.db')
+    parser.add_argument('--admin-db', default='admin.db')
+    parser.add_argument('--users-db', default='users.db')
+    parser.add_argument('--status', action='store_true', help="list pending migrations without applying them")
+    parser.add_argument('--check', action='store_true',
+                        help="run every route against a scratch dataset and fail if a query scans a table")
+    args = parser.parse_args()
+
+    if args.check:
+        checked, failures = check_query_plans()
+        if not failures:
+            print(f"All {checked} statements use an index.")
+            return
+        for sql, scans in failures.items():
+            print(f"{'; '.join(scans)}\n    {sql}")
+        raise SystemExit(1)
+
+    paths = {'main': args.flights_db, 'admin': args.admin_db, 'users': args.users_db}
+    if args.status:
+        todo = pending(paths)
+        for name, version, description in todo:
+            print(f"{paths[name]}: pending {version} ({description})")
+        if not todo:
+            print("Up to date.")
+        return
+    if not migrate(paths, log=print):
+        print("Up to date.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import getpass
+import json
+import os
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import admission
+
+# Stored in users.password_hash for guest accounts created at checkout.
+# It never matches a password, so the account has to be claimed (a real
+# password set through /claim) before anyone can log in to it.
+UNUSABLE_PASSWORD = '!'
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 2))
+HASH_QUEUE = int(os.environ.get('HASH_QUEUE', 16))
+HASH_QUEUE_TIMEOUT = float(os.environ.get('HASH_QUEUE_TIMEOUT', 2))
+
+# The KDF is deliberately slow. The gate caps how many request threads a
+# burst of logins can keep busy hashing at once, and turns the rest away
+# with a 503 instead of letting them queue without bound.
+_gate = admission.ConcurrencyGate('password_hash', HASH_WORKERS, HASH_QUEUE, HASH_QUEUE_TIMEOUT)
+
+
+def is_usable(pw_hash):
+    return bool(pw_hash) and pw_hash != UNUSABLE_PASSWORD
+
+
+def hash_password(password):
+    with _gate:
+        return generate_password_hash(password)
+
+
+def check_password(pw_hash, password):
+    if not is_usable(pw_hash):
+        return False
+    with _gate:
+        return check_password_hash(pw_hash, password)
+
+
+def load_admins(path):
+    # {username: password hash}; the hashes are generated offline with
+    # `python passwords.py USERNAME`, so nothing is hashed at import time.
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print an admin credentials entry with a pre-hashed password.")
+    parser.add_argument('username')
+    args = parser.parse_args()
+    password = getpass.getpass(f"Password for {args.username}: ")
+    print(json.dumps({args.username: generate_password_hash(password)}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def scratch_app(prefix, dataset_args=(), env=None):
+    # Generates a dataset with create_databases in a new temporary directory,
+    # makes that the working directory and imports the app against it, for
+    # the benchmark, the booking stress test and the query-plan check.
+    # `env` holds defaults for settings read at import; anything already set
+    # in the environment wins. Returns (app module, directory).
+    sys.path.insert(0, HERE)
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    os.chdir(workdir)
+    import create_databases
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_databases.main(list(dataset_args))
+    for name, value in (env or {}).items():
+        os.environ.setdefault(name, str(value))
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    app_module.app.root_path = workdir
+    os.symlink(os.path.join(HERE, 'templates'), os.path.join(workdir, 'templates'))
+    return app_module, workdir
@@ -0,0 +1,82 @@
+import re
+
+SEAT_ROWS = 4
+SEAT_COLS = 6
+SEAT_LABEL = re.compile(r'R(\d+)C(\d+)')
+
+
+class SeatUnavailable(Exception):
+    pass
+
+
+def seat_label(bit):
+    return f"R{bit // SEAT_COLS + 1}C{bit % SEAT_COLS + 1}"
+
+
+def seat_bit(label):
+    match = SEAT_LABEL.fullmatch(label.strip().upper()) if label else None
+    if match is None:
+        return None
+    row, col = int(match.group(1)), int(match.group(2))
+    if not (1 <= row <= SEAT_ROWS and 1 <= col <= SEAT_COLS):
+        return None
+    return (row - 1) * SEAT_COLS + (col - 1)
+
+
+def seat_mask(labels):
+    mask = 0
+    for label in labels:
+        bit = seat_bit(label)
+        if bit is None:
+            raise SeatUnavailable(f"Seat {label} does not exist.")
+        if mask & (1 << bit):
+            raise SeatUnavailable(f"Seat {label} was selected more than once.")
+        mask |= 1 << bit
+    return mask
+
+
+def bitmap_from_bookings(conn, flight_id):
+    bitmap = 0
+    for (label,) in conn.execute(
+            'SELECT seat_number FROM bookings WHERE flight_id = ? AND seat_number IS NOT NULL', (flight_id,)):
+        bit = seat_bit(label)
+        if bit is not None:
+            bitmap |= 1 << bit
+    return bitmap
+
+
+def load_bitmap(conn, flight_id):
+    row = conn.execute('SELECT occupied FROM seat_inventory WHERE flight_id = ?', (flight_id,)).fetchone()
+    if row is not None:
+        return row[0]
+    # Flights booked before the inventory existed get their bitmap built
+    # from bookings once; readers just use the computed value.
+    return bitmap_from_bookings(conn, flight_id)
+
+
+def booked_seats(conn, flight_id):
+    bitmap = load_bitmap(conn, flight_id)
+    return [seat_label(bit) for bit in range(SEAT_ROWS * SEAT_COLS) if bitmap & (1 << bit)]
+
+
+def claim_seats(conn, flight_id, labels):
+    # Must run inside a BEGIN IMMEDIATE transaction so the compare-and-set
+    # and the seat-count decrement commit together with the booking rows.
+    mask = seat_mask(labels)
+    if conn.execute('SELECT 1 FROM seat_inventory WHERE flight_id = ?', (flight_id,)).fetchone() is None:
+        conn.execute('INSERT INTO seat_inventory (flight_id, occupied) VALUES (?, ?)',
+                     (flight_id, bitmap_from_bookings(conn, flight_id)))
+    claimed = conn.execute(
+        'UPDATE seat_inventory SET occupied = occupied | ? WHERE flight_id = ? AND occupied & ? = 0',
+        (mask, flight_id, mask)
+    ).rowcount
+    if not claimed:
+        taken = load_bitmap(conn, flight_id) & mask
+        taken_labels = ', '.join(seat_label(bit) for bit in range(SEAT_ROWS * SEAT_COLS) if taken & (1 << bit))
+        raise SeatUnavailable(f"Seat {taken_labels} is already booked. Please choose another.")
+    decremented = conn.execute(
+        'UPDATE flights SET seats = seats - ? WHERE id = ? AND seats >= ?',
+        (len(labels), flight_id, len(labels))
+    ).rowcount
+    if not decremented:
+        raise SeatUnavailable('Sorry, this flight is no longer available.')
@@ -0,0 +1,96 @@
+import gc
+import logging
+import os
+
+from gunicorn.app.base import BaseApplication
+
+import catalog
+import db
+import itineraries
+import migrations
+
+PORT = int(os.environ.get('PORT', 5000))
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 2))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+# How long a worker told to stop (SIGTERM, or replaced on SIGHUP) may keep
+# finishing in-flight requests before it is killed.
+GRACEFUL_TIMEOUT = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+WORKER_TIMEOUT = int(os.environ.get('WORKER_TIMEOUT', 60))
+
+log = logging.getLogger(__name__)
+
+
+def warm(app):
+    # Runs in the master before any worker exists: everything built here is
+    # inherited copy-on-write instead of rebuilt once per worker.
+    migrations.migrate({'main': app.config['DATABASE'], 'admin': app.config['ADMIN_DB'],
+                        'users': app.config['USERS_DB']})
+    flight_catalog = catalog.get_catalog(app.config['DATABASE'])
+    snapshot = flight_catalog.snapshot()
+    itineraries.get_network(flight_catalog)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # An SQLite handle must never cross fork(): close every one the master
+    # opened. Workers open their own on first use.
+    db.close_pools()
+    catalog.close_catalogs()
+    # Keep the warmed objects out of the collector so its bookkeeping writes
+    # don't un-share their pages in every worker.
+    gc.freeze()
+    log.info("Warmed catalog (%d flights) and %d templates",
+             len(snapshot.flights), len(app.jinja_env.list_templates()))
+
+
+def post_fork(server, worker):
+    # Per-worker setup. warm() left no connections behind, but a worker must
+    # start from empty pools whatever the master did.
+    db.close_pools()
+    catalog.close_catalogs()
+
+
+class Server(BaseApplication):
+    # Pre-fork gunicorn master with threaded (gthread) workers. The app is
+    # loaded and warmed once in the master (preload_app), which also keeps
+    # one SECRET_KEY fallback across workers so sessions survive any worker.
+    #   SIGHUP      start fresh workers from the master, then drain the old
+    #               ones; the catalog is re-warmed first. Code is not
+    #               reloaded: the master holds the preloaded app.
+    #   SIGUSR2     re-exec a new master on the same socket (new code);
+    #               send the old master SIGQUIT once the new one is up.
+    #   SIGTERM     graceful stop: drain for up to GRACEFUL_TIMEOUT seconds.
+    def __init__(self, app, options=None):
+        self.application = app
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        warm(self.application)
+        return self.application
+
+
+def options(host='0.0.0.0', port=PORT, workers=WEB_WORKERS, threads=WEB_THREADS):
+    return {
+        'bind': f'{host}:{port}',
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'timeout': WORKER_TIMEOUT,
+        'accesslog': '-',
+        'post_fork': post_fork,
+        'on_reload': lambda server: warm(server.app.application),
+    }
+
+
+def run(app, **kwargs):
+    Server(app, options(**kwargs)).run()
+
+
+if __name__ == '__main__':
+    from app import app
+    run(app)
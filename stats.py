@@ -0,0 +1,77 @@
+import argparse
+import sqlite3
+
+import migrations
+
+# The stats tables, their seed values and the triggers that maintain them
+# are created by migrations (main 6, admin 2, users 1); this module reads
+# them and checks them against the live tables.
+
+# (schema, counter, query that recomputes it from scratch)
+COUNTERS = (
+    ('main', 'flights', "SELECT COUNT(*) FROM main.flights"),
+    ('main', 'bookings', "SELECT COUNT(*) FROM main.bookings"),
+    ('users', 'users', "SELECT COUNT(*) FROM users.users"),
+    ('admin', 'revenue', "SELECT COALESCE(SUM(amount), 0) FROM admin.payments"),
+)
+
+STATS_QUERY = '''
+SELECT name, value FROM main.stats
+UNION ALL SELECT name, value FROM users.stats
+UNION ALL SELECT name, value FROM admin.stats
+'''
+
+
+def read_stats(conn):
+    stats = {name: 0 for _, name, _ in COUNTERS}
+    stats.update((row[0], row[1]) for row in conn.execute(STATS_QUERY))
+    return stats
+
+
+def reconcile(conn, fix=False):
+    # Returns {counter: (stored, actual)} for every counter that drifted and,
+    # with fix=True, overwrites the stored value in the same transaction.
+    # BEGIN IMMEDIATE keeps writers out while counters are compared.
+    conn.execute('BEGIN IMMEDIATE' if fix else 'BEGIN')
+    try:
+        stored = read_stats(conn)
+        drift = {}
+        for schema, name, query in COUNTERS:
+            actual = conn.execute(query).fetchone()[0]
+            if abs((stored.get(name) or 0) - actual) > 1e-6:
+                drift[name] = (stored.get(name), actual)
+                if fix:
+                    conn.execute(f"INSERT OR REPLACE INTO {schema}.stats (name, value) VALUES (?, ?)",
+                                 (name, actual))
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return drift
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the admin dashboard counters and report drift.")
+    parser.add_argument('--flights-db', default='flights.db')
+    parser.add_argument('--admin-db', default='admin.db')
+    parser.add_argument('--users-db', default='users.db')
+    parser.add_argument('--fix', action='store_true', help="overwrite drifted counters with the recomputed values")
+    args = parser.parse_args()
+
+    migrations.migrate({'main': args.flights_db, 'admin': args.admin_db, 'users': args.users_db})
+    conn = sqlite3.connect(args.flights_db)
+    conn.execute("ATTACH DATABASE ? AS admin", (args.admin_db,))
+    conn.execute("ATTACH DATABASE ? AS users", (args.users_db,))
+    drift = reconcile(conn, fix=args.fix)
+    conn.close()
+    if not drift:
+        print("All counters match.")
+        return
+    for name, (stored, actual) in drift.items():
+        print(f"{name}: stored {stored}, actual {actual}" + (" (fixed)" if args.fix else ""))
+    if not args.fix:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import contextlib
+import io
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+from scratch import scratch_app
+from seats import SEAT_COLS, SEAT_ROWS, seat_label
+
+ALL_SEATS = [seat_label(bit) for bit in range(SEAT_ROWS * SEAT_COLS)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Hammer POST /book/<id> from many threads and check for double-bookings.")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--flights', type=int, default=5, help="number of flights to spread bookings over")
+    parser.add_argument('--attempts', type=int, default=50, help="booking attempts per thread")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def worker(app, flight_ids, attempts, seed, counters, lock):
+    rng = random.Random(seed)
+    client = app.test_client()
+    for i in range(attempts):
+        flight_id = rng.choice(flight_ids)
+        response = client.post(f'/book/{flight_id}', data={
+            'full_name': f'Stress {seed} {i}',
+            'email': f'stress-{seed}-{i}@example.com',
+            'phone': '5550000',
+            'passport': f'{seed:04d}{i:04d}',
+            'card_number': '4111111111111111',
+            'selected_seat': rng.choice(ALL_SEATS),
+        })
+        if response.status_code == 200:
+            key = 'booked'
+        elif response.status_code in (429, 503):
+            key = 'overloaded'
+        else:
+            key = 'rejected'
+        with lock:
+            counters[key] += 1
+
+
+def check_inventory(db_path, flight_ids):
+    conn = sqlite3.connect(db_path)
+    problems = []
+    duplicates = conn.execute('''
+        SELECT flight_id, seat_number, COUNT(*) FROM bookings
+        GROUP BY flight_id, seat_number HAVING COUNT(*) > 1
+    ''').fetchall()
+    for flight_id, seat, count in duplicates:
+        problems.append(f"flight {flight_id} seat {seat} booked {count} times")
+    for flight_id in flight_ids:
+        booked = conn.execute('SELECT COUNT(*) FROM bookings WHERE flight_id = ?', (flight_id,)).fetchone()[0]
+        seats_left = conn.execute('SELECT seats FROM flights WHERE id = ?', (flight_id,)).fetchone()[0]
+        row = conn.execute('SELECT occupied FROM seat_inventory WHERE flight_id = ?', (flight_id,)).fetchone()
+        bitmap_count = bin(row[0]).count('1') if row else 0
+        if not booked == bitmap_count == 100 - seats_left:
+            problems.append(f"flight {flight_id}: {booked} bookings, {bitmap_count} bitmap seats, "
+                            f"{seats_left} seats left")
+    conn.close()
+    return problems
+
+
+def main():
+    args = parse_args()
+    # Every thread posts from the same address; this exercises the booking
+    # gate, not the per-client rate limit.
+    app_module, workdir = scratch_app('stress-booking-', env={'BOOKING_BURST': args.threads * args.attempts})
+    app = app_module.app
+    flight_ids = list(range(1, args.flights + 1))
+
+    counters = {'booked': 0, 'rejected': 0, 'overloaded': 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=worker, args=(app, flight_ids, args.attempts, args.seed * 1000 + n,
+                                                     counters, lock))
+               for n in range(args.threads)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.perf_counter() - started
+    app_module.ticket_queue.shutdown()
+
+    total = sum(counters.values())
+    print(f"{args.threads} threads, {total} attempts in {elapsed:.2f}s "
+          f"({total / elapsed:.1f} req/s, {counters['booked'] / elapsed:.1f} bookings/s)")
+    print(f"booked: {counters['booked']}  rejected: {counters['rejected']}  "
+          f"overloaded: {counters['overloaded']}  "
+          f"capacity: {len(flight_ids) * len(ALL_SEATS)} seats")
+    problems = check_inventory(app.config['DATABASE'], flight_ids)
+    conn = sqlite3.connect(app.config['DATABASE'])
+    stored = conn.execute('SELECT COUNT(*) FROM bookings').fetchone()[0]
+    conn.close()
+    if stored != counters['booked']:
+        problems.append(f"{counters['booked']} confirmations but {stored} booking rows")
+    if problems:
+        print("FAILED:")
+        for problem in problems:
+            print("  " + problem)
+        sys.exit(1)
+    print(f"OK: zero double-bookings (data in {workdir})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+TICKETS_DIR = 'tickets'
+TICKET_WORKERS = int(os.environ.get('TICKET_WORKERS', 2))
+PENDING = 'pending'
+READY = 'ready'
+
+log = logging.getLogger(__name__)
+
+
+def ticket_path(booking_ref):
+    return os.path.join(TICKETS_DIR, f"{booking_ref}.pdf")
+
+
+def _draw_page(c, full_name, flight_no, seat_number, origin, destination, booking_ref, group_ref=None):
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(100, 750, "PASSENGER NAME")
+    c.setFont("Helvetica", 14)
+    c.drawString(100, 730, full_name)
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(100, 700, "FLIGHT")
+    c.setFont("Helvetica", 14)
+    c.drawString(100, 680, flight_no)
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(100, 650, "SEAT")
+    c.setFont("Helvetica", 14)
+    c.drawString(100, 630, seat_number)
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(100, 600, f"{origin} → {destination}")
+    c.setFont("Helvetica", 10)
+    c.drawString(100, 400, f"Booking Ref: {booking_ref}")
+    if group_ref:
+        c.drawString(100, 385, f"Group Ref: {group_ref}")
+
+
+def _render_pages(ticket_ref, pages, group_ref=None):
+    path = ticket_path(ticket_ref)
+    os.makedirs(TICKETS_DIR, exist_ok=True)
+    # Draw into a temporary file and rename it into place so a download
+    # never picks up a half-written PDF. The name is unique per call: two
+    # threads may render the same missing ticket at once.
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{ticket_ref}.", suffix='.tmp', dir=TICKETS_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            c = canvas.Canvas(f, pagesize=letter)
+            for page in pages:
+                _draw_page(c, *page, group_ref=group_ref)
+                c.showPage()
+            c.save()
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def render_ticket(booking_ref, full_name, flight_no, seat_number, origin, destination):
+    return _render_pages(booking_ref, [(full_name, flight_no, seat_number, origin, destination, booking_ref)])
+
+
+def render_group_ticket(group_ref, flight_no, origin, destination, passengers):
+    # One PDF for the whole group, a page per passenger;
+    # passengers is [(full_name, seat_number, booking_ref), ...].
+    return _render_pages(group_ref, [(name, flight_no, seat, origin, destination, ref)
+                                     for name, seat, ref in passengers], group_ref=group_ref)
+
+
+def timed_render_ticket(*args):
+    started = time.perf_counter()
+    render_ticket(*args)
+    return time.perf_counter() - started
+
+
+def timed_render_group_ticket(*args):
+    started = time.perf_counter()
+    render_group_ticket(*args)
+    return time.perf_counter() - started
+
+
+class TicketQueue:
+    def __init__(self, workers=TICKET_WORKERS, on_rendered=None):
+        self.workers = workers
+        self.on_rendered = on_rendered
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn rather than fork: the web process is multi-threaded and
+            # holds open SQLite handles that must not leak into the workers.
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def submit(self, booking_ref, *details, job=timed_render_ticket):
+        # A failed submit must not fail the booking that is already
+        # committed; download_ticket renders missing tickets on demand.
+        with self._lock:
+            try:
+                future = self._get_executor().submit(job, booking_ref, *details)
+            except BrokenProcessPool:
+                self._executor = None
+                try:
+                    future = self._get_executor().submit(job, booking_ref, *details)
+                except Exception as e:
+                    log.exception("Error queueing ticket: %s", e)
+                    return None
+            except Exception as e:
+                log.exception("Error queueing ticket: %s", e)
+                return None
+            self._jobs[booking_ref] = future
+        future.add_done_callback(lambda f: self._forget(booking_ref, f))
+        return future
+
+    def _forget(self, booking_ref, future):
+        with self._lock:
+            if self._jobs.get(booking_ref) is future:
+                del self._jobs[booking_ref]
+        if self.on_rendered is not None and not future.cancelled() and future.exception() is None:
+            self.on_rendered(future.result())
+
+    def status(self, booking_ref):
+        if os.path.exists(ticket_path(booking_ref)):
+            return READY
+        if booking_ref in self._jobs:
+            return PENDING
+        return None
+
+    def wait(self, booking_ref, timeout):
+        future = self._jobs.get(booking_ref)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except FutureTimeout:
+                return False
+            except Exception as e:
+                log.error("Error rendering ticket: %s", e)
+        return os.path.exists(ticket_path(booking_ref))
+
+    def shutdown(self):
+        # Done callbacks take self._lock, so wait for the pool outside it.
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)